@@ -0,0 +1,29 @@
+"""
+Benchmark of Rule.build_each against a loop of src >> rule.build() >> out, for a 100k-file compile node.
+
+Usage : PYTHONPATH=. python bench/bench_build_each.py [number of files]
+"""
+import sys
+from time import perf_counter
+from pathlib import Path
+from labs import Project, FileSet, ninja
+
+def make_project():
+  p = Project(Path('/src/labs_build.py'), Path('/src'), Path('/build'))
+  cc = p.Rule('cc', command='cc -c '+ninja.v_in+' -o '+ninja.v_out)
+  return p, cc
+
+if __name__ == '__main__' :
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  fs = FileSet(*( f'/src/dir{i % 100}/file{i}.c' for i in range(n) ))
+  p, cc = make_project()
+  t0 = perf_counter()
+  for f in fs.str_sorted() :
+    f >> cc.build(flags='-O2') >> (f[:-2] + '.o')
+  t1 = perf_counter()
+  p2, cc = make_project()
+  t2 = perf_counter()
+  cc.build_each(fs, '{dir}/{stem}.o', flags='-O2')
+  t3 = perf_counter()
+  assert ''.join(p.iter_ninja()) == ''.join(p2.iter_ninja())
+  print(f'{n} builds : loop {t1-t0:.2f} s, build_each {t3-t2:.2f} s ({(t1-t0)/(t3-t2):.1f}x)')
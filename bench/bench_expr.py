@@ -0,0 +1,18 @@
+"""
+Micro-benchmark of the construction of long commands with quote_arg_list.
+The time per argument should stay constant when the number of arguments grows.
+
+Usage : PYTHONPATH=. python bench/bench_expr.py
+"""
+from timeit import timeit
+from labs.ninja import quote_arg_list
+
+def bench(n, repeat=3):
+  args = [ f'obj/file_{i}.o' for i in range(n) ]
+  t = min( timeit(lambda : str(quote_arg_list('cc', '-o', 'out', *args)), number=1) for _ in range(repeat) )
+  return t
+
+if __name__ == '__main__' :
+  for n in (1000, 10000, 100000) :
+    t = bench(n)
+    print(f'{n:>7} args : {t*1000:8.2f} ms ({t/n*1e6:.3f} us/arg)')
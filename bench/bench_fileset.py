@@ -0,0 +1,35 @@
+"""
+Memory and time of a FileSet of 1M files, compared with the list and set of Path objects it used to hold.
+
+Usage : PYTHONPATH=. python bench/bench_fileset.py [files]
+"""
+import sys
+import tracemalloc
+from time import perf_counter
+from pathlib import Path
+from labs.core import FileSet
+
+def measure(f):
+  tracemalloc.start()
+  t = perf_counter()
+  res = f()
+  t = perf_counter() - t
+  mem = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return res, t, mem
+
+if __name__ == '__main__' :
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  names = [ f'src/module_{i // 1000}/file_{i}.cpp' for i in range(n) ]
+  cwd = Path('/home/user/project')
+
+  def paths():
+    l = [ cwd / a for a in names ]
+    return l, set(l)
+  _, t_paths, m_paths = measure(paths)
+  fs, t_fs, m_fs = measure(lambda : FileSet(names, cwd=cwd))
+  print(f'{n} files : list+set of Path {m_paths / 2**20:.0f} MiB in {t_paths:.2f} s, FileSet {m_fs / 2**20:.0f} MiB in {t_fs:.2f} s ({m_paths / m_fs:.1f}x less memory)')
+  _, t, _ = measure(lambda : fs.split_types())
+  print(f'split_types : {t:.2f} s')
+  _, t, _ = measure(lambda : fs.toNinja())
+  print(f'toNinja : {t:.2f} s')
@@ -0,0 +1,33 @@
+"""
+Benchmark of gitindex.read_index and walker.filter_paths on a synthetic version 2 index of 300k files.
+
+Usage : PYTHONPATH=. python bench/bench_gitindex.py [files]
+"""
+import sys
+import struct
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from labs.gitindex import read_index
+from labs.walker import filter_paths
+
+def make_index(path, n):
+  names = sorted( f'src/d{i // 1000}/s{i // 100 % 10}/f{i}.c'.encode() for i in range(n) )
+  with open(path, 'wb') as f :
+    f.write(struct.pack('>4sLL', b'DIRC', 2, n))
+    for name in names :
+      entry = struct.pack('>10L', 0, 0, 0, 0, 0, 0, 0o100644, 0, 0, 0) + bytes(20) + struct.pack('>H', len(name)) + name
+      f.write(entry + bytes(8 - len(entry) % 8))
+
+if __name__ == '__main__' :
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+  with tempfile.TemporaryDirectory() as d :
+    index = Path(d)/'index'
+    make_index(index, n)
+    t0 = perf_counter()
+    paths = read_index(index, 20)
+    t1 = perf_counter()
+    res = list(filter_paths(paths, ['src/**/*.c'], exclude=['src/d1']))
+    t2 = perf_counter()
+  assert len(paths) == n
+  print(f'{n} entries : read {t1-t0:.2f} s, filter {t2-t1:.2f} s ({len(res)} matches)')
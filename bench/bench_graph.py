@@ -0,0 +1,31 @@
+"""
+Benchmark of utils.Graph on a random DAG of 1M vertices and 5M edges.
+
+Usage : PYTHONPATH=. python bench/bench_graph.py [vertices] [edges]
+"""
+import sys
+import random
+from time import perf_counter
+from labs.utils import Graph
+
+def make_dag(n, m, seed=0):
+  rnd = random.Random(seed)
+  adj = [ [] for _ in range(n) ]
+  for _ in range(m) :
+    a = rnd.randrange(n - 1)
+    adj[a].append(rnd.randrange(a + 1, n))
+  return adj
+
+if __name__ == '__main__' :
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  m = int(sys.argv[2]) if len(sys.argv) > 2 else 5000000
+  adj = make_dag(n, m)
+  t0 = perf_counter()
+  g = Graph(range(n), adj.__getitem__)
+  t1 = perf_counter()
+  order = g.topologicalSort()
+  t2 = perf_counter()
+  order = g.topologicalSort(False)
+  t3 = perf_counter()
+  assert len(order) == n
+  print(f'{n} vertices, {m} edges : build {t1-t0:.2f} s, sort {t2-t1:.2f} s, reverse sort {t3-t2:.2f} s')
@@ -0,0 +1,30 @@
+"""
+Benchmark of the generation of a large build.ninja.
+
+Usage : PYTHONPATH=. python bench/bench_manifest.py [number of builds]
+"""
+import sys
+import os
+import tempfile
+from time import perf_counter
+from pathlib import Path
+from labs import Project, ninja
+
+def make_project(n, src=Path('/abs/path/to/the/sources'), build=Path('/abs/path/to/the/build')):
+  p = Project(src/'labs_build.py', src, build)
+  cc = p.Rule('cc', command='cc -c '+ninja.v_in+' -o '+ninja.v_out, deps='gcc', depfile=ninja.v_out+'.d')
+  cc << '/usr/bin/cc'
+  for i in range(n) :
+    (src/f'dir{i % 100}'/f'file{i}.c') >> cc.build(flags='-O2 -Wall') >> (build/f'dir{i % 100}'/f'file{i}.o')
+  return p
+
+if __name__ == '__main__' :
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  p = make_project(n)
+  with tempfile.TemporaryDirectory() as d :
+    out = Path(d)/'build.ninja'
+    t = perf_counter()
+    with out.open('w') as f :
+      p.writeNinja(f)
+    t = perf_counter() - t
+    print(f'{n} builds : {t*1000:.1f} ms, {out.stat().st_size/1e6:.2f} MB')
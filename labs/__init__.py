@@ -1,17 +1,29 @@
 
 import os
+import sys
 import subprocess
 import shlex
 import shutil
+import json
+import base64
+import hashlib
+import threading
+import posixpath
 from pathlib import Path
 from itertools import chain
 from collections import namedtuple
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from .utils import Dict
 
 from . import ninja
 from . import cmake
-from .utils import Graph
+from . import utils
+from .utils import Graph, JsonCache, write_chunks, write_if_changed, stat_signature
+from . import walker
+from . import gitindex
 from .core import *
 from .options import STRING, INT, FLOAT, BOOL, PATH, FILEPATH, DeclaredOption, LazyOptions
 
@@ -26,9 +38,15 @@ class ProgramNotFoundError(RuntimeError):
 class RuleNameConflictError(RuntimeError):
   pass
 
+class PoolNameConflictError(RuntimeError):
+  pass
+
 class VariablesNotInProjectError(RuntimeError):
   pass
 
+class NodeCycleError(RuntimeError):
+  pass
+
 
 class Rule(ninja.Rule):
   def __init__(self, project, name, rule_variables={}, **kwargs):
@@ -42,6 +60,11 @@ class Rule(ninja.Rule):
     self.project << b
     return b
 
+  def build_each(self, inputs, outputs, **kwargs) -> list:
+    res = super().build_each(inputs, outputs, **kwargs)
+    self.project.add_builds(res)
+    return res
+
   def add_implicit_dep(self, o):
     self.implicit_deps |= o
   
@@ -87,12 +110,14 @@ class Program(object):
   def path(self):
     return self._path if self._path != ... else self.name
 
-  def exec(self, *args, input=None, capture=True, **kwargs):
+  def exec(self, *args, input=None, capture=True, memoize=None, env_deps=(), **kwargs):
     """
     Simple wrapper around run.
     To have more control, use run. stdin can be either a str, a bytes, or a file
     @param input : either a str, a bytes or file-like.
     @param text : set to true to use input / output in text mode
+    @param memoize : reuse the result of a previous identical call (same binary, arguments, input, env_deps and keyword arguments), even from a previous configuration. Defaults to project.memoize_exec. A file-like input is never memoized.
+    @param env_deps : names of the environment variables the result depends on
     @return (exit_code, stdout, stderr)
     """
     if self.path is None :
@@ -118,8 +143,50 @@ class Program(object):
     kwargs.update(kw)
     if len(args) == 1 and not isinstance(args[0], str) :
       args = args[0]
+    if memoize is None :
+      memoize = self.project.memoize_exec
+    if not memoize or kwargs.get('stdin') is not None :
+      res = self.run(args, **kwargs)
+      return (res.returncode, res.stdout, res.stderr)
+    key = self.exec_key(args, kwargs, env_deps)
+    memo = self.project.exec_memo_get(key)
+    if memo is not None :
+      return _decode_exec_result(memo)
     res = self.run(args, **kwargs)
-    return (res.returncode, res.stdout, res.stderr)
+    res = (res.returncode, res.stdout, res.stderr)
+    self.project.exec_memo_set(key, _encode_exec_result(res))
+    return res
+
+  def exec_async(self, *args, **kwargs):
+    """
+    Same as exec, but run in the thread pool of the project (see Project.executor).
+    @return a concurrent.futures.Future of (exit_code, stdout, stderr)
+    """
+    return self.project.executor.submit(self.exec, *args, **kwargs)
+
+  def exec_key(self, args, kwargs, env_deps=()) -> str:
+    """
+    Memoization key of exec(*args, **kwargs) : identifies the binary (path, device, inode, size, mtime), the arguments, the input, the environment variables env_deps and the other keyword arguments
+    """
+    try:
+      st = os.stat(self.path)
+      identity = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+    except (OSError, TypeError) :
+      identity = None
+    kwargs = dict(kwargs)
+    input = kwargs.pop('input', None)
+    if isinstance(input, bytes) :
+      input = base64.b64encode(input).decode('ascii')
+    env = kwargs.get('env', os.environ)
+    data = [
+      str(self.path),
+      identity,
+      [ str(a) for a in args ],
+      input,
+      { k : env.get(k) for k in env_deps },
+      sorted(( k, repr(v) ) for k, v in kwargs.items()),
+    ]
+    return hashlib.sha256(json.dumps(data).encode('utf8')).hexdigest()
 
   def run(self, *args, **kwargs):
     """
@@ -214,6 +281,80 @@ class _VariableProject(ninja.Variable):
 
 def _varDep(v:ninja.Variable):
   return ( dep for dep in v.value.value if isinstance(dep, ninja.Variable) )
+
+def _encode_output(o):
+  if isinstance(o, bytes) :
+    return { 'b' : base64.b64encode(o).decode('ascii') }
+  return o
+
+def _decode_output(o):
+  if isinstance(o, dict) :
+    return base64.b64decode(o['b'])
+  return o
+
+def _encode_exec_result(res):
+  returncode, stdout, stderr = res
+  return [returncode, _encode_output(stdout), _encode_output(stderr)]
+
+def _decode_exec_result(res):
+  returncode, stdout, stderr = res
+  return (returncode, _decode_output(stdout), _decode_output(stderr))
+
+def _literal(v):
+  """
+  The raw str of the build variable value v, or None if it references variables
+  """
+  if isinstance(v, str) :
+    return v
+  segments = ninja.Expr(v).value
+  if all( isinstance(x, str) for x in segments ) :
+    return ''.join(segments)
+  return None
+
+def _expand(v, values:dict) -> str:
+  """
+  The raw str of the value v, with the references to the variables of values (name -> raw str) replaced
+  """
+  return ''.join( (values.get(x.name, str(x)) if isinstance(x, ninja.Variable) else str(x)) for x in ninja.Expr(v).value )
+
+def _shared_literal_variables(builds) -> dict:
+  """
+  Variables set to the same literal value in all the builds, and not referenced by their other variables.
+  The reserved variables of ninja (pool, depfile, restat...) are read by ninja itself in the builds, thus never listed.
+  """
+  first = builds[0]
+  res = {}
+  for k, v in first.items() :
+    if k in ninja.builtin_variables :
+      continue
+    l = _literal(v)
+    if l is not None :
+      res[k] = l
+  for b in builds[1:] :
+    if not res :
+      return res
+    for k in list(res) :
+      v = b.get(k, _literal)
+      if v is not first[k] and (v is _literal or _literal(v) != res[k]) :
+        del res[k]
+  if res :
+    for b in builds :
+      for v in b.values() :
+        if not isinstance(v, str) :
+          for x in ninja.Expr(v).value :
+            if isinstance(x, ninja.Variable) :
+              res.pop(x.name, None)
+  return res
+
+@lru_cache(maxsize=None)
+def _labs_stamp():
+  """
+  Stamp of the installed labs sources. A configuration made by another version of labs is never reused.
+  """
+  return stat_signature(sorted(Path(__file__).parent.rglob('*.py')))
+
+def _depfile_escape(s:str):
+  return s.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
   
 
 class Project(object):
@@ -221,16 +362,33 @@ class Project(object):
   Root of a build. Each Projects intance corresponds to a ninja file.
   You should use this class to get any ninja primitives instead of instanciating them yourself.
   """
+  ninja_filename = 'build.ninja'
+  regenerate_rule_name = 'labs_regenerate'
+
   def __init__(self, labs_path:Path, src_dir:Path, build_dir:Path, config=dict()):
     self.rules = dict()
+    self.pools = dict() # Name -> ninja.Pool declared in the manifest
     self.build_rules = dict()
     self.build_rules_flat = []
+    self.build_nodes = dict() # id of a build -> Node which added it
     self.nodes = []
     self.variables = Dict()
     self.v = _VariableProxy(self)
     self.config = Dict(config)
     self.declared_options = Dict()
     self.found_programs = dict()
+    self.known_programs = dict() # Program names resolved in the PATH -> path (or None if not found). Persisted between runs by Labs
+    self.memoize_exec = False # Default of the memoize parameter of Program.exec
+    self.exec_caches = [JsonCache()] # Stores of the memoized Program.exec results, looked up in order
+    self.glob_cache = JsonCache() # Results of LabsContext.glob, with the mtimes of the directories they were read from
+    self.probe_jobs = None # Number of Program.exec_async running concurrently. Defaults to the number of CPUs
+    self._executor = None
+    self.jobs = 1 # Number of nodes processed concurrently by freeze
+    self.compact_manifest = True # Merge the identical rules, inline the variables shared by all the builds of a rule (see plan_rules) and share the repeated dependency groups (see plan_deps)
+    self.manifest_stats = None # Dependency edges of the last manifest written (see plan_deps)
+    self.factor_paths = True # Write the absolute paths of the build and source directories in a shorter form (see plan_paths)
+    self._lock = threading.RLock()
+    self._journal = threading.local() # Additions made by the node processed in the current thread (see freeze)
     self.labs_path = labs_path
     self.src_dir = src_dir
     self.build_dir = build_dir
@@ -239,10 +397,35 @@ class Project(object):
     self._v_labs = _VariableProject('labs_path', lambda : str(self.labs_path))
     self._unique_build_dir_number = 0
     self.frozen = False
+    self.configure_deps = dict() # Ordered set of the files and directories read at configure time
+    self.regenerate_command = None # Command line re-running the configuration. If None, build.ninja does not regenerate itself
+
+  # Arguments of utils.pool_depth for the pools created without depth, by name
+  pool_presets = {
+    'link' : dict(memory_per_job=2 << 30), # Linkers need much memory, especially with LTO
+    'install' : dict(cpus_per_job=2), # Bound by the disk rather than the CPUs
+  }
 
   def Rule(self, name, **kwargs):
     return Rule(self, name, **kwargs)
 
+  def Pool(self, name, depth=None, **kwargs) -> ninja.Pool:
+    """
+    Declare the pool name and return it, to be set as the pool variable of rules or builds.
+    Without depth, it is computed from the CPUs and the total memory by utils.pool_depth(**kwargs), or with the preset of name (see pool_presets),
+    and an already declared pool is returned as is. The builtin console pool is never declared.
+    """
+    if name in ninja.builtin_pools :
+      return ninja.builtin_pools[name]
+    if depth is None :
+      p = self.pools.get(name)
+      if p is not None and not kwargs :
+        return p
+      depth = utils.pool_depth(**(kwargs or self.pool_presets.get(name, {})))
+    p = ninja.Pool(name, depth)
+    self.add_pool(p)
+    return p
+
   def Program(self, name:str, path:Path=None):
     return Program(self, name, path)
 
@@ -265,7 +448,7 @@ class Project(object):
     for n in names :
       if isinstance(n, Path) :
         n = str(n)
-      path = shutil.which(n)
+      path = self.which(n)
       if path is not None :
         path = Path(path).resolve()
         break
@@ -273,6 +456,48 @@ class Project(object):
     self.found_programs[name] = res
     return res
 
+  def which(self, name:str):
+    """
+    Find the executable name in the PATH. The lookups of bare names are memoized in self.known_programs.
+    """
+    if os.sep in name :
+      return utils.which(name)
+    try:
+      return self.known_programs[name]
+    except KeyError :
+      res = self.known_programs[name] = utils.which(name)
+      return res
+
+  @property
+  def executor(self) -> ThreadPoolExecutor:
+    """
+    Thread pool running the configure-time probes (see Program.exec_async). Created on first use.
+    """
+    if self._executor is None :
+      self._executor = ThreadPoolExecutor(max_workers=self.probe_jobs or os.cpu_count() or 1, thread_name_prefix='labs-probe')
+    return self._executor
+
+  def shutdown_executor(self):
+    """
+    Wait for the pending probes and release the threads of self.executor
+    """
+    if self._executor is not None :
+      self._executor.shutdown(wait=True)
+      self._executor = None
+
+  def exec_memo_get(self, key):
+    for i, c in enumerate(self.exec_caches) :
+      res = c.get(key)
+      if res is not None :
+        for c2 in self.exec_caches[:i] :
+          c2[key] = res
+        return res
+    return None
+
+  def exec_memo_set(self, key, value):
+    for c in self.exec_caches :
+      c[key] = value
+
   def unique_build_dir(self):
     res = build_dir / f'_unique_build_dir-{self._unique_build_dir_number:05d}' # type: Path
     res.mkdir(parents=True, exist_ok=True)
@@ -299,29 +524,91 @@ class Project(object):
   def v_build(self):
     return self._v_build
   
+  def _record(self, container, o):
+    entries = getattr(self._journal, 'entries', None)
+    if entries is not None :
+      entries.append((container, o))
+
   def add_rule(self, r:Rule):
-    _r = self.rules.get(r.name, None)
-    if _r is not None :
-      if _r is not r :
-        raise RuleNameConflictError('Trying to add a different rule with existing name "{r.name}"')
-      return
-    self.rules[r.name] = r
+    with self._lock :
+      _r = self.rules.get(r.name, None)
+      if _r is not None :
+        if _r is not r :
+          raise RuleNameConflictError('Trying to add a different rule with existing name "{r.name}"')
+        return
+      self.rules[r.name] = r
+      self._record('rules', r.name)
+
+  def add_pool(self, p:ninja.Pool):
+    with self._lock :
+      _p = self.pools.get(p.name, None)
+      if _p is not None :
+        if _p.depth != p.depth :
+          raise PoolNameConflictError(f'Trying to add the pool "{p.name}" of depth {p.depth}, declared with the depth {_p.depth}')
+        return
+      self.pools[p.name] = p
+      self._record('pools', p.name)
 
   def add_build(self, b:ninja.Build):
-    self.add_rule(b.rule)
-    for t in chain(b.explicit.o, b.implicit.o) :
-      s = self.build_rules.get(t, None)
-      if s is None :
-        s = set()
-        self.build_rules[t] = s
-      s.add(b)
-    self.build_rules_flat.append(b)
+    self.add_builds((b,))
+
+  def add_builds(self, builds):
+    """
+    Add several builds at once, taking the lock once
+    """
+    builds = list(builds)
+    with self._lock, utils.gc_paused() :
+      build_rules = self.build_rules
+      rule = None
+      for b in builds :
+        if b.rule is not rule :
+          rule = b.rule
+          self.add_rule(rule)
+        for t in b.outputs() :
+          s = build_rules.get(t, None)
+          if s is None :
+            build_rules[t] = [b]
+          else:
+            s.append(b)
+      self.build_rules_flat.extend(builds)
+      node = getattr(self._journal, 'node', None)
+      if node is not None :
+        self.build_nodes.update( (id(b), node) for b in builds )
+      entries = getattr(self._journal, 'entries', None)
+      if entries is not None :
+        entries.extend( ('build_rules_flat', b) for b in builds )
+
+  @contextmanager
+  def processing(self, node:Node):
+    """
+    Attribute the builds added by the current thread in the block to node (see build_nodes)
+    """
+    parent = getattr(self._journal, 'node', None)
+    self._journal.node = node
+    try:
+      yield
+    finally:
+      self._journal.node = parent
 
   def add_node(self, o:Node):
-    self.nodes.append(o)
+    with self._lock :
+      self.nodes.append(o)
+      self._record('nodes', o)
 
   def add_variable(self, v):
-    self.variables[v.name] = v
+    with self._lock :
+      self.variables[v.name] = v
+      self._record('variables', v.name)
+
+  def add_configure_dep(self, *paths):
+    """
+    Declare files or directories read at configure time. build.ninja will be regenerated when they change.
+    """
+    with self._lock :
+      for p in paths :
+        p = Path(p)
+        self.configure_deps[p] = None
+        self._record('configure_deps', p)
   
   def __lshift__(self, o):
     if isinstance(o, ninja.Build) :
@@ -341,10 +628,86 @@ class Project(object):
   add = __lshift__
 
   def freeze(self):
+    """
+    Process all the nodes, the dependencies of a node (see Node.add) before it. The nodes created meanwhile are processed too.
+    If self.jobs > 1, independent nodes are processed concurrently, with the same result as a sequential processing.
+    """
     if self.frozen :
       return
-    for n in self.nodes :
-      n.process()
+    while (pending := [ n for n in self.nodes if not n._frozen ]) :
+      order = self.node_order(pending)
+      if self.jobs > 1 and len(order) > 1 :
+        self._process_concurrently(order)
+      else:
+        for n in order :
+          n.process()
+
+  def node_order(self, nodes) -> list:
+    """
+    Sort nodes so that each node comes after its dependencies, in creation order otherwise.
+    """
+    nodes_set = set(nodes)
+    g = Graph(nodes, lambda n: [ d for d in n.dependencies if d in nodes_set ])
+    try:
+      return list(g.topologicalSort(reverse=False))
+    except Graph.CycleError as e :
+      raise NodeCycleError('Cyclic dependency between nodes : ' + ' -> '.join(map(repr, e.cycle))) from e
+
+  def _process_concurrently(self, order):
+    """
+    Process the nodes of order (topologically sorted) on self.jobs threads, a node starting once its dependencies are processed.
+    The additions to the project are journaled per node, then reordered as if the nodes had been processed sequentially in order,
+    so that the output does not depend on the scheduling.
+    """
+    index = { n : i for i, n in enumerate(order) }
+    waiting = [0] * len(order)
+    dependents = [ [] for _ in order ]
+    for i, n in enumerate(order) :
+      for d in set(n.dependencies) :
+        j = index.get(d)
+        if j is not None :
+          waiting[i] += 1
+          dependents[j].append(i)
+    journals = [ [] for _ in order ]
+    ordered = {
+      'rules' : list(self.rules),
+      'pools' : list(self.pools),
+      'variables' : list(self.variables),
+      'configure_deps' : list(self.configure_deps),
+    }
+    sequences = {
+      'build_rules_flat' : len(self.build_rules_flat),
+      'nodes' : len(self.nodes),
+    }
+
+    def run(i):
+      self._journal.entries = journals[i]
+      try:
+        order[i].process()
+      finally:
+        self._journal.entries = None
+      return i
+
+    with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='labs-node') as executor :
+      running = { executor.submit(run, i) for i, w in enumerate(waiting) if w == 0 }
+      while running :
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for f in done :
+          for j in dependents[f.result()] :
+            waiting[j] -= 1
+            if waiting[j] == 0 :
+              running.add(executor.submit(run, j))
+
+    entries = [ e for j in journals for e in j ]
+    for name, start in sequences.items() :
+      getattr(self, name)[start:] = [ o for c, o in entries if c == name ]
+    for name, keys in ordered.items() :
+      d = getattr(self, name)
+      keys = dict.fromkeys(chain(keys, ( o for c, o in entries if c == name )))
+      items = [ (k, d[k]) for k in keys if k in d ]
+      d.clear()
+      for k, v in items :
+        d[k] = v
 
   @property
   def ninja_preamble(self):
@@ -367,6 +730,12 @@ class Project(object):
 ######### Variables  #########
 ##############################
 
+'''
+  ninja_sep_before_pools = '''
+##############################
+########### Pools  ###########
+##############################
+
 '''
   ninja_sep_before_rules = '''
 ##############################
@@ -386,31 +755,282 @@ class Project(object):
 ##############################
 
 '''
-  def writeNinja(self, f):
+  def iter_ninja(self):
+    """
+    Generate the content of the ninja file as a sequence of str chunks.
+    The chunks can be consumed by any sink (file, hash, compressor...). See writeNinja.
+    """
     self.freeze()
-    f.write(self.ninja_preamble)
-    f.write(self.ninja_sep_before_variables)
+    yield self.ninja_preamble
+    yield self.ninja_sep_before_variables
     sorted_vars = Graph(self.variables.values(), _varDep).topologicalSort(False)
     if len(sorted_vars) != len(self.variables) :
       raise VariablesNotInProjectError('Some variables have not been created in the project')
-    v = None
+    rewrite, path_vars = self.plan_paths()
+    sorted_vars = path_vars + sorted_vars
     for v in sorted_vars :
-      f.write(v.toNinja())
-      f.write('\n')
-    if v is not None :
-      f.write('\n')
-    f.write(self.ninja_sep_before_rules)
+      yield v.toNinja()
+      yield '\n'
+    if sorted_vars :
+      yield '\n'
+    pools = self.plan_pools()
+    if pools :
+      yield self.ninja_sep_before_pools
+      for p in pools :
+        yield p.toNinja()
+        yield '\n\n'
+    regenerate = self.regenerate_build()
+    names, inlined = self.plan_rules()
+    yield self.ninja_sep_before_rules
     for r in self.rules.values() :
-      f.write(r.toNinja())
-      f.write('\n\n')
-    f.write(self.ninja_sep_before_builds)
+      if names[r.name] == r.name :
+        yield r.toNinja(inline=inlined.get(r.name, {}))
+        yield '\n\n'
+    if regenerate is not None :
+      yield regenerate.rule.toNinja()
+      yield '\n\n'
+    yield self.ninja_sep_before_builds
+    inputs, stamps, self.manifest_stats = self.plan_deps(rewrite)
+    for i, b in enumerate(self.build_rules_flat) :
+      name = names[b.rule.name]
+      yield from b.iter_ninja(name, inlined.get(name, ()), rewrite, inputs.get(i))
+      yield '\n\n'
+    if stamps :
+      st = self.manifest_stats
+      yield f'# {st.stamps} phony stamps : {st.edges} dependency edges written as {st.edges_compacted}\n'
+      for stamp, deps in stamps :
+        yield f'build {stamp} : phony {deps}\n\n'
+    if regenerate is not None :
+      yield from regenerate.iter_ninja(rewrite=rewrite)
+      yield '\n\n'
+    yield self.ninja_end
+
+  def plan_pools(self) -> list:
+    """
+    The pools declared in the manifest : the ones of self.pools, then the other ones set as pool variable of a rule or a build.
+    """
+    pools = dict(self.pools)
+    def add(p):
+      if isinstance(p, ninja.Pool) and not p.builtin :
+        _p = pools.setdefault(p.name, p)
+        if _p.depth != p.depth :
+          raise PoolNameConflictError(f'The pool "{p.name}" is used with the depths {_p.depth} and {p.depth}')
+    for r in self.rules.values() :
+      v = r._b.get('pool')
+      if v is not None :
+        add(v.value)
     for b in self.build_rules_flat :
-      other_dep = getattr(b.rule, 'implicit_deps', None)
-      if other_dep :
-        implicit(other_dep) >> b
-      f.write(b.toNinja())
-      f.write('\n\n')
-    f.write(self.ninja_end)
+      add(b.get('pool'))
+    return list(pools.values())
+
+  def plan_rules(self):
+    """
+    Plan the deduplication of the rules written in the manifest, without modifying the rules or the builds. Return (names, inlined) :
+    names maps each rule name to the name it is written under, the first of the rules with the same statement.
+    inlined maps a written rule name to the variables set to the same literal value by all its builds (2 at least) :
+    ninja rules only accept their reserved variables, thus the value is inlined in the rule statement, and not written in the builds.
+    """
+    names = { name : name for name in self.rules }
+    if not self.compact_manifest :
+      return names, {}
+    statements = {}
+    for r in self.rules.values() :
+      # The statement without the 'rule <name>' line
+      names[r.name] = statements.setdefault(r.toNinja(name=''), r.name)
+    groups = {}
+    for b in self.build_rules_flat :
+      groups.setdefault(names[b.rule.name], []).append(b)
+    inlined = {}
+    for name, builds in groups.items() :
+      if len(builds) > 1 :
+        shared = _shared_literal_variables(builds)
+        if shared :
+          inlined[name] = shared
+    return names, inlined
+
+  stamp_prefix = 'labs_deps_'
+
+  def plan_deps(self, rewrite=None):
+    """
+    Plan the implicit and order-only inputs of the builds, without modifying them : the implicit_deps of a rule are implicit inputs of all its builds.
+    When compact_manifest is set, a group of inputs shared by several builds is replaced by a phony stamp depending on the group,
+    if it lowers the number of dependency edges : n builds depending on m paths give n + m edges instead of n * m.
+    Return (inputs, stamps, stats) : inputs maps the index of a build in build_rules_flat to its pair of inputs written (see Build.iter_ninja),
+    stamps lists the (stamp, group) phony builds, and stats counts the dependency edges, before and after the compaction.
+    """
+    rule_deps = {} # rule -> Target of its implicit_deps
+    groups = {} # written group -> [number of builds, number of paths]
+    inputs = {}
+    def group(t):
+      if not t :
+        return None
+      key = t.toNinja(rewrite)
+      g = groups.get(key)
+      if g is None :
+        groups[key] = [1, len(t)]
+      else:
+        g[0] += 1
+      return key
+    for i, b in enumerate(self.build_rules_flat) :
+      d = b.__dict__
+      imp = d.get('implicit')
+      oo = d.get('order_only')
+      rule = b.rule
+      other = rule_deps.get(rule)
+      if other is None :
+        other = getattr(rule, 'implicit_deps', None)
+        other = rule_deps[rule] = ninja.Target(other) if other else ninja.Target()
+      if other :
+        if imp and imp.i :
+          t = ninja.Target(imp.i)
+          t |= other
+        else:
+          t = other
+      else:
+        t = imp.i if imp else None
+      if t or (oo and oo.i) :
+        inputs[i] = (group(t), group(oo.i if oo else None))
+    edges = sum( n * m for n, m in groups.values() )
+    stats = Dict(stamps=0, edges=edges, edges_compacted=edges)
+    stamped = {}
+    if self.compact_manifest :
+      for key, (n, m) in groups.items() :
+        if n * m > n + m :
+          stamped[key] = self.stamp_prefix + hashlib.sha1(key.encode()).hexdigest()[:12]
+          stats.edges_compacted -= n * m - n - m
+    if stamped :
+      stats.stamps = len(stamped)
+      for i, (imp, oo) in inputs.items() :
+        inputs[i] = (stamped.get(imp, imp), stamped.get(oo, oo))
+    return inputs, [ (stamp, key) for key, stamp in stamped.items() ], stats
+
+  def plan_paths(self):
+    """
+    Plan the factoring of the paths of the builds. Return (rewrite, variables) : rewrite maps an escaped path to the one to write (or is None),
+    and variables are the ninja variables it references. When they are absolute, the paths under build_dir are written relative to it,
+    since ninja runs in the build directory, and the ones under src_dir start with ${src_dir}.
+    """
+    prefixes = []
+    variables = []
+    if self.factor_paths :
+      build_dir = str(self.build_dir)
+      if os.path.isabs(build_dir) :
+        prefixes.append((ninja.escape(build_dir), ''))
+      src_dir = str(self.src_dir)
+      v = self.variables.get(self._v_src.name)
+      if os.path.isabs(src_dir) and v in (None, self._v_src) :
+        prefixes.append((ninja.escape(src_dir), str(self._v_src)))
+        if v is None :
+          variables.append(ninja.Variable(self._v_src.name, src_dir))
+    if not prefixes :
+      return None, variables
+    # The longest prefix first, in case one directory is in the other one
+    prefixes.sort(key=lambda p: -len(p[0]))
+    def rewrite(s):
+      for p, r in prefixes :
+        if s.startswith(p) :
+          n = len(p)
+          if len(s) == n :
+            return r or '.'
+          if s[n] == '/' :
+            return r + s[n:] if r else s[n + 1:]
+      return s
+    return rewrite, variables
+
+  def node_labels(self) -> dict:
+    """
+    Label of each node, its class name and its rank among the nodes of this class (e.g. 'Cc#0'), stable between runs
+    """
+    counts = {}
+    res = {}
+    for n in self.nodes :
+      name = n.__class__.__name__
+      i = counts.get(name, 0)
+      counts[name] = i + 1
+      res[n] = f'{name}#{i}'
+    return res
+
+  def graph(self) -> dict:
+    """
+    The build graph, to be joined with the ninja log (see labs.stats). For each build : its outputs, as ninja logs them,
+    the name of its rule, the label of the node which added it (or None, see node_labels) and the indexes of the builds producing its inputs.
+    """
+    self.freeze()
+    values = {}
+    for v in chain((self._v_src, self._v_build, self._v_labs), Graph(self.variables.values(), _varDep).topologicalSort(False)) :
+      values[v.name] = _expand(v.value, values)
+    build_dir = str(self.build_dir)
+    def log_path(e):
+      p = _expand(e, values)
+      if os.path.isabs(p) and os.path.isabs(build_dir) :
+        rel = os.path.relpath(p, build_dir)
+        if rel != '..' and not rel.startswith('../') :
+          p = rel
+      return posixpath.normpath(p)
+    paths = {} # Expr -> log path
+    def cached_log_path(e):
+      p = paths.get(e)
+      if p is None :
+        p = paths[e] = log_path(e)
+      return p
+    labels = self.node_labels()
+    res = []
+    producers = {}
+    for i, b in enumerate(self.build_rules_flat) :
+      outputs = [ cached_log_path(o) for o in b.outputs() ]
+      for o in outputs :
+        producers.setdefault(o, i)
+      node = self.build_nodes.get(id(b))
+      res.append({
+        'outputs' : outputs,
+        'rule' : b.rule.name,
+        'node' : None if node is None else labels.get(node),
+        'deps' : [],
+      })
+    for i, b in enumerate(self.build_rules_flat) :
+      inputs = [ b.explicit.i, getattr(b.rule, 'implicit_deps', None) ]
+      inputs.extend( t.i for t in (b.__dict__.get('implicit'), b.__dict__.get('order_only')) if t is not None )
+      deps = { producers.get(cached_log_path(p)) for t in inputs if t for p in t.paths }
+      deps.discard(None)
+      deps.discard(i)
+      res[i]['deps'] = sorted(deps)
+    return { 'version' : 1, 'builds' : res }
+
+  def writeNinja(self, f):
+    write_chunks(f, self.iter_ninja())
+
+  @property
+  def depfile_name(self):
+    return self.ninja_filename + '.d'
+
+  def regenerate_build(self) -> ninja.Build:
+    """
+    Build statement re-running the configuration when one of self.configure_deps changed (they are listed in the depfile, see iter_depfile).
+    The rule is a generator with restat, thus ninja starts building immediately if the configuration did not change build.ninja.
+    Return None if self.regenerate_command is None.
+    """
+    if self.regenerate_command is None :
+      return None
+    r = ninja.Rule(
+      self.regenerate_rule_name,
+      command=ninja.quote_arg_list(*map(str, self.regenerate_command)),
+      description=f'Regenerating {self.ninja_filename}',
+      depfile=self.depfile_name,
+      generator='1',
+      restat='1',
+    )
+    return self.labs_path >> r.build() >> self.ninja_filename
+
+  def iter_depfile(self):
+    """
+    Generate the content of the depfile of build.ninja, listing self.configure_deps, as a sequence of str chunks.
+    """
+    yield _depfile_escape(self.ninja_filename)
+    yield ':'
+    for p in self.configure_deps :
+      yield ' \\\n  '
+      yield _depfile_escape(str(p))
+    yield '\n'
   
   @property
   def cache_preamble(self):
@@ -456,29 +1076,35 @@ class Project(object):
 ##############################
 
 '''
-  def writeCache(self, f):
+  def iter_cache(self):
+    """
+    Generate the content of the cache file as a sequence of str chunks. See iter_ninja.
+    """
     self.freeze()
     conf = Dict(self.config)
-    f.write(self.cache_preamble)
-    f.write(self.cache_sep_before_user_declared)
+    yield self.cache_preamble
+    yield self.cache_sep_before_user_declared
     keys = sorted(self.declared_options.keys())
     for k in keys :
       c = conf.pop(k)
       dc = self.declared_options[k]
-      f.write(cmake.varToCache(k, c, dc.type, dc.description, dc.default_value))
-      f.write('\n\n')
-    f.write(self.cache_sep_before_internal)
+      yield cmake.varToCache(k, c, dc.type, dc.description, dc.default_value)
+      yield '\n\n'
+    yield self.cache_sep_before_internal
     for c in (self.v_labs, self.v_src, self.v_build) :
       conf.pop(c.name, None)
     keys = sorted(conf.keys())
     for k in keys :
       c = conf[k]
-      f.write(cmake.varToCache(k, c))
-      f.write('\n\n')
+      yield cmake.varToCache(k, c)
+      yield '\n\n'
     for c in (self.v_labs, self.v_src, self.v_build) :
-      f.write(cmake.varToCache(c.name, c.value))
-      f.write('\n\n')
-    f.write(self.cache_end)
+      yield cmake.varToCache(c.name, c.value)
+      yield '\n\n'
+    yield self.cache_end
+
+  def writeCache(self, f):
+    write_chunks(f, self.iter_cache())
 
 
 
@@ -490,11 +1116,65 @@ class LabsContext(object):
     self.labs = labs
     self.project = labs.project
 
-  def glob(self, pattern, conf={}):
-    res = self.FileSet(*self.project.src_dir.glob(pattern), conf=conf, cwd=Path(), as_is=True)
-    res.cwd = self.project.src_dir
-    return res
+  def glob(self, *patterns, conf={}, exclude=(), threads=None, lazy=False):
+    """
+    FileSet of the paths of the source directory matching any of the patterns, in a single traversal (see labs.walker.Walker).
+    The build directory, the VCS directories and the directories matching exclude are not looked into.
+    The result of the previous run is reused when none of the directories it listed changed since.
+    With lazy, a LazyFileSet is returned, and the walk only happens when its paths are needed.
+    """
+    if lazy :
+      return self.LazyFileSet(lambda : self._glob_matches(patterns, exclude, threads), conf=conf)
+    return self.FileSet(*self._glob_matches(patterns, exclude, threads), conf=conf)
+
+  def _glob_matches(self, patterns, exclude, threads):
+    """
+    Generate the matches of glob, then store them in the glob cache and add the directories listed to the configure deps
+    """
+    project = self.project
+    key = json.dumps([ str(project.src_dir), str(project.build_dir), list(map(str, patterns)), list(map(str, exclude)) ])
+    cached = project.glob_cache.get(key)
+    if cached is not None and walker.dirs_unchanged(project.src_dir, cached['dirs']) :
+      yield from cached['matches']
+      dirs = cached['dirs']
+    else:
+      w = walker.Walker(project.src_dir, patterns, exclude=exclude, prune_paths=(project.build_dir,), threads=threads)
+      matches = []
+      for m in w.walk() :
+        matches.append(m)
+        yield m
+      dirs = w.visited
+      project.glob_cache[key] = { 'matches' : matches, 'dirs' : dirs }
+    project.add_configure_dep(*( project.src_dir / d for d in dirs ))
   
+  def git_files(self, *patterns, conf={}, exclude=()):
+    """
+    FileSet of the files of the source directory tracked by git and matching any of the patterns (see glob),
+    read from the git index instead of walking the tree. Falls back to glob if the source directory is not in a git work tree.
+    Untracked files are not listed, while tracked files deleted from the work tree are.
+    """
+    project = self.project
+    repo = gitindex.find_repository(project.src_dir)
+    paths = None
+    if repo is not None :
+      root, index_path = repo
+      try:
+        paths = gitindex.read_index(index_path)
+      except (OSError, gitindex.GitIndexError) :
+        pass
+    if paths is None :
+      return self.glob(*patterns, conf=conf, exclude=exclude)
+    src_dir = os.path.abspath(project.src_dir)
+    prefix = os.path.relpath(src_dir, root).replace(os.sep, '/') + '/'
+    if prefix != './' :
+      paths = [ p[len(prefix):] for p in paths if p.startswith(prefix) ]
+    build_prefix = os.path.relpath(os.path.abspath(project.build_dir), src_dir).replace(os.sep, '/') + '/'
+    if not build_prefix.startswith(('../', './')) :
+      paths = [ p for p in paths if not p.startswith(build_prefix) ]
+    res = self.FileSet(*walker.filter_paths(paths, patterns, exclude), conf=conf)
+    project.add_configure_dep(self.labs.format_path(index_path))
+    return res
+
   def FileSet(self, *args, cwd=None, as_is=False, **kwargs):
     if cwd is None :
       _cwd = self.project.src_dir
@@ -507,15 +1187,21 @@ class LabsContext(object):
     else:
       return FileSet(*args, **kwargs, cwd=_cwd)
 
+  def LazyFileSet(self, source, cwd=None, **kwargs):
+    return LazyFileSet(source, **kwargs, cwd=self.project.src_dir if cwd is None else cwd)
+
   def getContext(self):
     return {
       'glob' : self.glob,
+      'git_files' : self.git_files,
       'sh_esc' : shlex.quote,
       
       'Rule' : self.project.Rule,
       'Program' : self.project.Program,
       'Variable' : self.project.Variable,
+      'Pool' : self.project.Pool,
       'FileSet' : self.FileSet,
+      'LazyFileSet' : self.LazyFileSet,
       'find_program' : self.project.find_program,
       'add' : self.project.add,
       
@@ -565,26 +1251,39 @@ class Labs(object):
   default_labs_filename = 'labs_build.py'
   default_cache_filename = 'labs_cache'
   default_ninja_build_filename = 'build.ninja'
+  state_dirname = '.labs'
+  fingerprint_filename = 'fingerprint.json'
+  programs_filename = 'programs.json'
+  exec_cache_filename = 'exec_cache.json'
+  glob_cache_filename = 'glob_cache.json'
+  graph_filename = 'graph.json'
 
   absolute_path_key = '__LABS_ABSPATH'
   relative_path_key = '__LABS_RELPATH'
+  memoize_exec_key = '__LABS_MEMOIZE_EXEC'
+  shared_exec_cache_key = '__LABS_SHARED_EXEC_CACHE'
+
+  labs_package_dir = Path(__file__).parent
 
   """
   Main class to parse labs_build.py files.
   This is the backend used by the CLI. You should normally use the CLI to build a project,
   but it may be useful to invoke it from an already running python script.
   """
-  def __init__(self, src_path=None, build_path=None, config=dict(), use_cache=True):
+  def __init__(self, src_path=None, build_path=None, config=dict(), use_cache=True, jobs=1):
     """
     @param src_path : sources root path (path of the root directory or the build file). If a directory is passed, it will try src_path/labs_build.py
     @param build_path : build root directory
     @param config : configuration overiding the defaults and the cache.
+    @param use_cache : read the cache, and skip the configuration if none of its inputs changed since the last run.
+    @param jobs : number of nodes processed concurrently.
     """
     if build_path is None :
       self.build_path = Path.cwd().resolve()
     else:
       self.build_path = Path(build_path).resolve()
     self.override_config = config
+    self.use_cache = use_cache
     
     config = Dict()
     
@@ -610,27 +1309,155 @@ class Labs(object):
     if not os.access(self.labs_path, os.R_OK) :
       raise OSError("labs_build not fount or missing authorisations")
 
+    self.relative_paths = False
     if cmake.str2bool(config.get(self.absolute_path_key, True)) :
       self.labs_path = self.labs_path.absolute()
       self.src_path = self.src_path.absolute()
       self.build_path = self.build_path.absolute()
     elif cmake.str2bool(config.get(self.relative_path_key, False)) :
+      self.relative_paths = True
       cwd = Path.cwd().absolute()
       self.labs_path = Path(os.path.relpath(self.labs_path, cwd))
       self.src_path = Path(os.path.relpath(self.src_path, cwd))
       self.build_path = Path(os.path.relpath(self.build_path, cwd))
 
     self.project = Project(self.labs_path, self.src_path, self.build_path, config)
+    self.project.ninja_filename = self.default_ninja_build_filename
+    self.project.regenerate_command = [*self.labs_command(), str(self.labs_path), '-C', str(self.build_path)]
+    self.project.memoize_exec = cmake.str2bool(config.get(self.memoize_exec_key, False))
+    self.project.jobs = jobs
+    self.project.exec_caches = [JsonCache(self.state_path/self.exec_cache_filename)]
+    if cmake.str2bool(config.get(self.shared_exec_cache_key, False)) :
+      self.project.exec_caches.append(JsonCache(self.shared_exec_cache_path(), keep_all=True))
+    self.project.glob_cache = JsonCache(self.state_path/self.glob_cache_filename)
 
   @classmethod
   def parse_cache(cls, cache_path:Path):
     with cache_path.open('r') as f :
       return cmake.parse_cache(f)
 
+  @classmethod
+  def labs_command(cls):
+    """
+    Command invoking the labs CLI
+    """
+    labs_cli = shutil.which('labs')
+    if labs_cli is not None :
+      return [labs_cli]
+    return [sys.executable, '-m', 'labs.cli']
+
+  @classmethod
+  def shared_exec_cache_path(cls) -> Path:
+    """
+    User-level store of the memoized Program.exec results, shared by all the build directories
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home()/'.cache'
+    return Path(cache_home)/'labs'/cls.exec_cache_filename
+
+  def format_path(self, p) -> Path:
+    """
+    Make p absolute or relative to the current directory, as the source and build paths are.
+    """
+    if self.relative_paths :
+      return Path(os.path.relpath(p, Path.cwd()))
+    return Path(p).absolute()
+
+  def ext_module_files(self):
+    """
+    Files of the currently imported labs extensions (the ones shipped with labs excepted)
+    """
+    import labs.ext as ext
+    res = []
+    for k, m in list(sys.modules.items()) :
+      f = getattr(m, '__file__', None)
+      if not k.startswith(ext._prefix) or f is None :
+        continue
+      f = Path(f)
+      if self.labs_package_dir in f.absolute().parents :
+        continue
+      res.append(self.format_path(f))
+    return res
+
+  @property
+  def state_path(self) -> Path:
+    """
+    Directory where labs keeps its own state between runs
+    """
+    return self.build_path/self.state_dirname
+
+  def fingerprint(self, deps) -> str:
+    """
+    Digest of everything the configuration output depends on : the labs version, the overriden config, PATH,
+    the paths and the current directory they were computed from, and the stats of deps.
+    """
+    path_index = utils.path_index()
+    data = [
+      _labs_stamp(),
+      sorted(( str(k), str(v) ) for k, v in self.override_config.items()),
+      path_index.path,
+      stat_signature(path_index.dirs),
+      str(self.labs_path),
+      str(self.build_path),
+      os.getcwd() if self.relative_paths else None,
+      stat_signature(deps),
+    ]
+    return hashlib.sha256(json.dumps(data).encode('utf8')).hexdigest()
+
+  def is_up_to_date(self) -> bool:
+    """
+    True if the previous configuration of self.build_path is still valid
+    """
+    try:
+      with (self.state_path/self.fingerprint_filename).open('r') as f :
+        fp = json.load(f)
+    except (OSError, ValueError) :
+      return False
+    return fp.get('digest') == self.fingerprint(fp.get('deps', []))
+
+  def write_fingerprint(self, outputs):
+    deps = [ str(p) for p in chain(self.project.configure_deps, outputs) ]
+    self.state_path.mkdir(exist_ok=True)
+    fp = { 'digest' : self.fingerprint(deps), 'deps' : deps }
+    write_if_changed(self.state_path/self.fingerprint_filename, [json.dumps(fp, indent=1)])
+
+  def _programs_key(self):
+    path_index = utils.path_index()
+    return { 'PATH' : path_index.path, 'dirs' : stat_signature(path_index.dirs) }
+
+  def load_programs(self):
+    """
+    Restore the programs found by the previous run, unless PATH or one of its directories changed since.
+    """
+    try:
+      with (self.state_path/self.programs_filename).open('r') as f :
+        data = json.load(f)
+    except (OSError, ValueError) :
+      return
+    key = self._programs_key()
+    if all( data.get(k) == v for k, v in key.items() ) :
+      self.project.known_programs.update(data.get('programs', {}))
+
+  def write_programs(self):
+    self.state_path.mkdir(exist_ok=True)
+    data = self._programs_key()
+    data['programs'] = self.project.known_programs
+    write_if_changed(self.state_path/self.programs_filename, [json.dumps(data, indent=1)])
+
   def process(self):
+    """
+    Configure the project : execute the build file and write the ninja file and the cache.
+    Nothing is done if self.use_cache is set and no input changed since the last run (see fingerprint).
+    """
     import labs.ext as ext
     import labs.runtime as runtime
     
+    if self.use_cache :
+      if self.is_up_to_date() :
+        return
+      self.load_programs()
+      for c in self.project.exec_caches :
+        c.load()
+      self.project.glob_cache.load()
     self.build_path.mkdir(parents=True, exist_ok=True)
     
     with self.labs_path.open('rb') as f :
@@ -644,12 +1471,24 @@ class Labs(object):
       _locals = dict()
       exec(labs_code, ctx.getContext(), _locals)
 
-      with (self.build_path/self.default_ninja_build_filename).open('w') as f :
-        self.project.writeNinja(f)
-
-      with (self.build_path/self.default_cache_filename).open('w') as f :
-        self.project.writeCache(f)
+      self.project.freeze()
+      self.project.shutdown_executor()
+      cache_path = self.build_path/self.default_cache_filename
+      self.project.add_configure_dep(self.labs_path, *self.ext_module_files(), cache_path)
+
+      depfile_path = self.build_path/self.project.depfile_name
+      ninja_path = self.build_path/self.default_ninja_build_filename
+      write_if_changed(cache_path, self.project.iter_cache())
+      write_if_changed(depfile_path, self.project.iter_depfile())
+      write_if_changed(ninja_path, self.project.iter_ninja())
+      self.write_programs()
+      write_if_changed(self.state_path/self.graph_filename, [json.dumps(self.project.graph(), separators=(',', ':'))])
+      for c in self.project.exec_caches :
+        c.save()
+      self.project.glob_cache.save()
+      self.write_fingerprint([depfile_path, ninja_path])
     finally:
+      self.project.shutdown_executor()
       ext._clean()
       runtime._ctx = None
     
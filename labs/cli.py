@@ -1,21 +1,43 @@
-
-
 from labs import Labs
 from .utils import Dict
+from . import stats as _stats
+from pathlib import Path
+import json
 import click
 
 
-@click.command(name="labs")
+class _DefaultGroup(click.Group):
+  """
+  Group running its default command when the first argument is not the name of a command, thus 'labs [SRC] ...' configures.
+  """
+  default_command = 'configure'
+
+  def parse_args(self, ctx, args):
+    if not args or (args[0] not in self.commands and args[0] != '--help') :
+      args = [self.default_command, *args]
+    return super().parse_args(ctx, args)
+
+
+@click.group(name="labs", cls=_DefaultGroup)
+def main():
+  pass
+
+
+@main.command()
 @click.argument('src', nargs=1, required=False, default=None)
 @click.option('--build-dir', '-C', type=str, default=None)
 @click.option('-D', type=str, multiple=True)
 @click.option('--debug', '-g', is_flag=True, default=False)
 @click.option('--clean', is_flag=True)
-def main(src, build_dir, d, debug, clean):
+@click.option('--jobs', '-j', type=int, default=1, help='Number of nodes processed concurrently')
+def configure(src, build_dir, d, debug, clean, jobs):
+  """
+  Configure the build directory (the default command)
+  """
   try:
     D = d
     config = dict(d.split('=', maxsplit=1) for d in D)
-    labs = Labs(src, build_dir, config, use_cache=not clean)
+    labs = Labs(src, build_dir, config, use_cache=not clean, jobs=jobs)
     labs.process()
   except:
     if debug :
@@ -23,8 +45,34 @@ def main(src, build_dir, d, debug, clean):
     else:
       raise
 
-if __name__ == "__main__" :
-  main()
 
+@main.command()
+@click.option('--build-dir', '-C', type=click.Path(file_okay=False, exists=True), default='.')
+@click.option('--json', 'as_json', is_flag=True, help='Write the statistics as JSON')
+@click.option('--top', type=int, default=10, help='Number of rules, nodes and edges listed')
+@click.option('--jobs', '-j', type=int, default=None, help='Number of jobs of the build, for the utilization (default : number of CPUs)')
+@click.option('--all-runs', is_flag=True, help='Time the last build of each output over all the runs of the log, without the wall time, parallelism and critical path')
+def stats(build_dir, as_json, top, jobs, all_runs):
+  """
+  Time spent by the last ninja run, per rule and node, with its critical path and parallelism
+  """
+  build_dir = Path(build_dir)
+  graph_path = build_dir/Labs.state_dirname/Labs.graph_filename
+  log_path = build_dir/'.ninja_log'
+  try:
+    graph = _stats.read_graph(graph_path)
+    runs = _stats.read_ninja_log(log_path)
+  except (OSError, ValueError, _stats.NinjaLogError) as e :
+    raise click.ClickException(str(e))
+  if all_runs :
+    res = _stats.analyze(_stats.latest_entries(runs), graph, jobs=jobs, top=top, timeline=False)
+  else:
+    res = _stats.analyze(runs[-1] if runs else [], graph, jobs=jobs, top=top)
+  if as_json :
+    click.echo(json.dumps(res, indent=1))
+  else:
+    click.echo(_stats.format_text(res, top=top), nl=False)
 
 
+if __name__ == "__main__" :
+  main()
@@ -7,11 +7,15 @@ Everythin is articulated around the Toolchain concept. A toolchain is analog to
 A Compiler knows how to translate a set of file of the type it supports as input to other file of another 
 """
 
+import re
+import sys
 import operator
+import threading
 from pathlib import Path
 from collections import deque
-from functools import reduce, cached_property
-from .utils import Dict, DefaultDict
+from itertools import islice
+from functools import reduce
+from .utils import Dict, DefaultDict, ConfDict
 from . import ninja
 import labs.runtime as lrt
 from labs.options import DeclaredOption
@@ -29,6 +33,8 @@ class FileType(object):
   A File type
   """
   filetypes = []
+  _suffix_index = {} # compound extension (e.g. 'cpp.d') -> FileType
+  _max_suffix_dots = 0 # Number of dots in the longest registered compound extension
 
   def __init__(self, name, aliases, description=''):
     self.name = name
@@ -37,21 +43,63 @@ class FileType(object):
   def __contains__(self, filename:Any):
     name = str(filename)
     return any( name.endswith(f'.{suffix}') for suffix in self.aliases )
-  
+
   @classmethod
   def addFileType(cls, name, aliases):
     ft = cls(name, aliases)
     cls.filetypes.append(ft)
     for a in aliases :
       setattr(cls, a, ft)
+      cls._suffix_index.setdefault(a, ft)
+      cls._max_suffix_dots = max(cls._max_suffix_dots, a.count('.'))
 
   @classmethod
-  def get(cls, filename:Any):
+  def lookup(cls, filename:Any):
+    """
+    Return the FileType of filename, or None if it is unknown.
+    The longest registered extension wins, thus 'foo.cpp.d' is 'hdeps' and not 'd'.
+    """
     name = str(filename)
-    try:
-      return next( ft for ft in cls.filetypes if name in ft) 
-    except StopIteration:
+    name = name[name.rfind('/') + 1:]
+    index = cls._suffix_index
+    # Find the first dot of the longest compound extension that could be registered
+    i = len(name)
+    for _ in range(cls._max_suffix_dots + 1) :
+      j = name.rfind('.', 0, i)
+      if j == -1 :
+        break
+      i = j
+    while i != -1 :
+      ft = index.get(name[i + 1:])
+      if ft is not None :
+        return ft
+      i = name.find('.', i + 1)
+    return None
+
+  @classmethod
+  def get(cls, filename:Any):
+    ft = cls.lookup(filename)
+    if ft is None :
       raise FileTypeNotFound(f'File type not found for filename {repr(filename)}')
+    return ft
+
+  @classmethod
+  def classify(cls, filenames:Iterable[Any], unknown='_') -> dict:
+    """
+    Group filenames by file type name in a single pass. Unknown files are grouped under the key `unknown`.
+    The groups (and their content) keep the order of first appearance.
+    """
+    res = {}
+    lookup = cls.lookup
+    for f in filenames :
+      ft = lookup(f)
+      k = unknown if ft is None else ft.name
+      l = res.get(k)
+      if l is None :
+        res[k] = [f]
+      else:
+        l.append(f)
+    return res
 
   @classmethod
   def __getitem__(cls, k):
@@ -72,36 +120,109 @@ FileType.addFileType('a', ('a',))
 
 
 
+_not_normal_path = re.compile(r'//|(^|/)\.(/|$)|/$').search
+
+def _path_str(a, cwd:Path, cwd_str:str) -> str:
+  """
+  str(cwd / a), without building Path objects when a is a str already in normal form
+  """
+  if isinstance(a, str) and a and not _not_normal_path(a) :
+    if a[0] == '/' or cwd_str == '.' :
+      return a
+    if cwd_str == '/' :
+      return '/' + a
+    return cwd_str + '/' + a
+  return str(cwd / a)
+
+
 class FileSet(ninja.Target):
   """
-  Set of input files
+  Set of input files.
+  The paths are stored once, as interned str in an insertion-ordered dict. The Path objects are only created when needed (see list and set).
+  The set operators (|, &, -, ^) keep the order of the left operand, then of the right one. All but - merge the conf of the right operand.
   """
   def __init__(self, *args, conf:Dict=None, import_conf=True, cwd=Path()):
+    self._list = None
+    self._set = None
     if len(args) == 1 :
       a, = args
       if isinstance(a, FileSet) and conf is None:
-        self.list = list(a.list)
-        self.set = set(a.set)
-        self.conf = Dict(a.conf)
+        self._paths = a._paths.copy()
+        self.conf = a.fork_conf()
         self.cwd = a.cwd
         return
-    self.set = set()
-    self.list = []
-    self.conf = Dict()
+    self._paths = {}
+    self.conf = ConfDict()
     self.cwd = cwd
     for a in args :
       self |= a
     if not import_conf :
-      self.conf = Dict()
+      self.conf = ConfDict()
     if conf is not None :
       self.conf |= conf
 
   def clone(self):
     return FileSet(self)
 
+  def _derive(self, strs) -> 'FileSet':
+    """
+    New FileSet containing the path strings strs, with the same cwd and a copy of the conf
+    """
+    res = FileSet(cwd=self.cwd)
+    res._paths = dict.fromkeys(strs)
+    res.conf = self.fork_conf()
+    return res
+
+  def _changed(self):
+    self._list = None
+    self._set = None
+    self._ninja = None
+
+  def fork_conf(self) -> ConfDict:
+    """
+    Return a copy-on-write copy of self.conf. The copy and self.conf do not see each other changes.
+    """
+    if not isinstance(self.conf, ConfDict) :
+      self.conf = ConfDict(base=self.conf)
+    self.conf, res = self.conf.fork()
+    return res
+
+  @property
+  def list(self) -> list:
+    """
+    The paths, as Path objects, in insertion order
+    """
+    res = self._list
+    if res is None :
+      res = self._list = list(map(Path, self._paths))
+    return res
+
+  @list.setter
+  def list(self, l):
+    self._paths = dict.fromkeys( sys.intern(str(p)) for p in l )
+    self._changed()
+
+  @property
+  def set(self) -> set:
+    """
+    The paths, as a set of Path objects
+    """
+    res = self._set
+    if res is None :
+      res = self._set = set(self.list)
+    return res
+
   def __iter__(self):
     return iter(self.list)
 
+  def _iter_paths(self):
+    """
+    Iterate over the paths as Path objects, without keeping them if they are not already materialized
+    """
+    if self._list is not None :
+      return iter(self._list)
+    return map(Path, self._paths)
+
   def __ior__(self, oth):
     if isinstance(oth, (bytes, bytearray)) :
       oth = oth.decode('utf8'),
@@ -109,11 +230,12 @@ class FileSet(ninja.Target):
       oth = oth,
     elif isinstance(oth, FileSet) :
       self.conf |= oth.conf
-    for a in oth :
-      p = self.cwd / a
-      if p not in self.set :
-        self.set.add(p)
-        self.list.append(p)
+      oth = oth._paths
+    cwd = self.cwd
+    cwd_str = str(cwd)
+    intern = sys.intern
+    self._paths.update(dict.fromkeys( intern(_path_str(a, cwd, cwd_str)) for a in oth ))
+    self._changed()
     return self
 
   def __or__(self, oth):
@@ -127,66 +249,45 @@ class FileSet(ninja.Target):
     return res
 
   def filter(self, pred):
-    res = FileSet(cwd=self.cwd)
-    res.list = [ a for a in self if pred(a) ]
-    res.set = set(res.list)
-    res.conf = Dict(self.conf)
-    return res
+    return self._derive( s for s, p in zip(self._paths, self._iter_paths()) if pred(p) )
 
   def partition(self, pred):
-    true_set, false_set = FileSet(cwd=self.cwd), FileSet(cwd=self.cwd)
-    pred = [ pred(a) for a in self ]
-    true_set.list = [ a for a, p in zip(self, pred) if p ]
-    false_set.list = [ a for a, p in zip(self, pred) if not p ]
-    true_set.set = set(true_set.list)
-    false_set.set = set(false_set.list)
-    true_set.conf = Dict(self.conf)
-    false_set.conf = Dict(self.conf)
+    pred = [ pred(a) for a in self._iter_paths() ]
+    true_set = self._derive( s for s, p in zip(self._paths, pred) if p )
+    false_set = self._derive( s for s, p in zip(self._paths, pred) if not p )
     return true_set, false_set
 
   def filter_drop(self, pred):
-    true_set = FileSet(cwd=self.cwd)
-    pred = [ pred(a) for a in self ]
-    true_set.list = [ a for a, p in zip(self, pred) if p ]
-    self.list = [ a for a, p in zip(self, pred) if not p ]
-    true_set.set = set(true_set.list)
-    self.set = set(self.list)
-    true_set.conf = Dict(self.conf)
+    pred = [ pred(a) for a in self._iter_paths() ]
+    true_set = self._derive( s for s, p in zip(self._paths, pred) if p )
+    self._paths = dict.fromkeys( s for s, p in zip(self._paths, pred) if not p )
+    self._changed()
     return true_set
 
   def split_types(self):
     res = Dict()
     if 'lang' in self.conf :
-      if not self.list :
+      if not self._paths :
         return res
       res[self.conf.lang] = self.clone()
       return res
-    _d = DefaultDict(lambda k: [])
-
-    for p in self.list :
-      try:
-        _d[FileType.get(p).name].append(p)
-      except:
-        _d['_'].append(p)
-    for k, l in _d.items() :
-      fs = FileSet(cwd=self.cwd)
-      fs.list = l
-      fs.set = set(l)
-      fs.conf = Dict(self.conf)
-      res[k] = fs
+    for k, l in FileType.classify(self._paths).items() :
+      res[k] = self._derive(l)
     return res
 
   def import_defaults(self, conf):
-    nc = Dict(conf)
+    """
+    Use conf for the keys missing in self.conf. conf is shared, not copied.
+    """
+    nc = ConfDict(base=conf)
     nc |= self.conf
     self.conf = nc
 
   def __len__(self):
-    return len(self.list)
+    return len(self._paths)
 
   def __contains__(self, a):
-    a = Path(a)
-    return a in self.set
+    return _path_str(a, Path(), '.') in self._paths
 
   def __getitem__(self, n) -> Path:
     return self.list[n]
@@ -194,13 +295,12 @@ class FileSet(ninja.Target):
   def __eq__(self, oth):
     if not isinstance(oth, FileSet) :
       return False
-    return self.list == oth.list and self.conf == oth.conf
+    return list(self._paths) == list(oth._paths) and self.conf == oth.conf
 
 
   def as_target(self) -> ninja.Target:
     """
     This method should be called only for optimization, since FileSet can act as a ninja.Target.
-    Another case is to be able to use the & and the ^ operators on the set.
     """
     res = ninja.Target()
     res.paths = set(self.set)
@@ -211,24 +311,164 @@ class FileSet(ninja.Target):
     return self.set
 
   def str_sorted(self):
-    return map(str, self.list)
+    return iter(self._paths)
+
+  def ninja_paths(self):
+    return map(ninja.escape, self._paths)
+
+  def toNinja(self, rewrite=None):
+    if rewrite is not None :
+      return ' '.join(map(rewrite, self.ninja_paths()))
+    res = self._ninja
+    if res is None :
+      res = ninja.escape_join(self.str_sorted())
+      self._ninja = res
+    return res
 
-  def ni(self): # pragma: no cover
-    return NotImplemented
+  def _operand(self, oth):
+    """
+    oth as a FileSet, or None if it is a Target that is not a FileSet
+    """
+    if isinstance(oth, FileSet) :
+      return oth
+    if isinstance(oth, ninja.Target) :
+      return None
+    return FileSet(oth, cwd=self.cwd)
+
+  def __iand__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    keep = oth._paths
+    self._paths = { s : None for s in self._paths if s in keep }
+    self.conf |= oth.conf
+    self._changed()
+    return self
 
-  __and__ = ni
-  __rand__ = ni
-  __iand__ = ni
+  def __isub__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    drop = oth._paths
+    self._paths = { s : None for s in self._paths if s not in drop }
+    self._changed()
+    return self
 
-  __xor__ = ni
-  __rxor__ = ni
-  __ixor__ = ni
-  
-  __sub__ = ni
-  __rsub__ = ni
-  __isub__ = ni
+  def __ixor__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    paths = self._paths
+    res = { s : None for s in paths if s not in oth._paths }
+    res.update( (s, None) for s in oth._paths if s not in paths )
+    self._paths = res
+    self.conf |= oth.conf
+    self._changed()
+    return self
 
-  del ni
+  def __and__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    res = FileSet(self)
+    res &= oth
+    return res
+
+  def __sub__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    res = FileSet(self)
+    res -= oth
+    return res
+
+  def __xor__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    res = FileSet(self)
+    res ^= oth
+    return res
+
+  def __rand__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    return oth & self
+
+  def __rsub__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    return oth - self
+
+  def __rxor__(self, oth):
+    oth = self._operand(oth)
+    if oth is None :
+      return NotImplemented
+    return oth ^ self
+
+
+
+class LazyFileSet(FileSet):
+  """
+  FileSet whose paths come from source, a callable returning an iterable of paths (or an iterable, that is iterated once).
+  The source is only iterated when the paths are needed, or streamed by iter_chunks when a streaming Node processes it.
+  It is safe to use from several threads (e.g. by nodes processed concurrently) : the source is iterated once.
+  """
+  def __init__(self, source, conf:Dict=None, cwd=Path(), chunk_size=4096):
+    super().__init__(conf=conf, cwd=cwd)
+    self._source = source
+    self._materialized = None
+    self._source_lock = threading.RLock()
+    self.chunk_size = chunk_size
+
+  @property
+  def _paths(self) -> dict:
+    res = self._materialized
+    if res is None :
+      with self._source_lock :
+        res = self._materialized
+        if res is None :
+          res = dict.fromkeys(self._iter_source())
+          self._materialized = res
+    return res
+
+  @_paths.setter
+  def _paths(self, paths):
+    self._materialized = paths
+
+  @property
+  def is_materialized(self) -> bool:
+    return self._materialized is not None
+
+  def _iter_source(self):
+    with self._source_lock :
+      source = self._source
+      if source is None :
+        raise RuntimeError('The source of this LazyFileSet has already been consumed')
+      if callable(source) :
+        source = source()
+      elif iter(source) is source :
+        self._source = None
+    cwd = self.cwd
+    cwd_str = str(cwd)
+    intern = sys.intern
+    return ( intern(_path_str(a, cwd, cwd_str)) for a in source )
+
+  def iter_chunks(self, size=None):
+    """
+    Generate the paths as FileSets of at most size paths (default self.chunk_size), with copies of self.conf.
+    Unless self is already materialized, the paths are not kept.
+    """
+    size = size or self.chunk_size
+    with self._source_lock :
+      it = iter(self._materialized) if self.is_materialized else self._iter_source()
+    while True :
+      chunk = list(islice(it, size))
+      if not chunk :
+        return
+      yield self._derive(chunk)
 
 
 
@@ -237,8 +477,10 @@ class Node(object):
   """
   Base class for a node in a toolchain.
   """
+  streaming = False # Process the LazyFileSet inputs chunk by chunk, without materializing them (the process_* methods are called once per chunk)
 
   def __init__(self, ctx=None):
+    self._lock = threading.RLock()
     self._frozen = False
     self._processing = False
     self._input = deque()
@@ -271,11 +513,13 @@ class Node(object):
     if self._frozen :
       raise NodeIsFrozenError()
     if self._processing :
+      self.dependencies.extend( dep for dep in dependencies if isinstance(dep, Node) )
       self._input.extendleft(reversed(dependencies))
       return
     for dep in dependencies :
       if isinstance(dep, Node) :
-        self._input.append(Node)
+        self.dependencies.append(dep)
+        self._input.append(dep)
         continue
       if isinstance(dep, ninja.Expr) :
         dep = ninja.Target(dep)
@@ -311,28 +555,32 @@ class Node(object):
     """
     Process the node. It will call all self.process_* function on each inputs.
     These methods should return an iterable of the output to add, and can call self.add() to reinject other sources.
+    It is safe to call it from several threads : the node is processed once, and the other threads wait for the end of the processing.
     """
-    if self._frozen :
-      return
-    if self._processing :
-      raise RecursionError('Already processing this node. Check for recursive Node dependency ?')
-    self._extend_output(self.preprocess())
-    self._processing = True
-    while self._input :
-      dep = self._input.popleft()
-      if isinstance(dep, Node) :
-        self.add(*dep.output)
-      elif isinstance(dep, FileSet) :
-        for lang, fs in dep.split_types().items() :
-          self._extend_output(
-            getattr(self, f'process_{lang}', self.process_)(fs)
-          )
-      elif isinstance(dep, ninja.Target) :
-        self._extend_output(self.process_target(dep))
-      else:
-        ValueError(f'This node type is not ({self.__class__.__name__}) is not able to process ({dep.__class__.__name__}) type')
-    self._frozen = True
-    self._extend_output(self.postprocess())
+    with self._lock, self.project.processing(self) :
+      if self._frozen :
+        return
+      if self._processing :
+        raise RecursionError('Already processing this node. Check for recursive Node dependency ?')
+      self._extend_output(self.preprocess())
+      self._processing = True
+      while self._input :
+        dep = self._input.popleft()
+        if isinstance(dep, Node) :
+          self.add(*dep.output)
+        elif isinstance(dep, FileSet) :
+          chunks = dep.iter_chunks() if self.streaming and isinstance(dep, LazyFileSet) else (dep,)
+          for chunk in chunks :
+            for lang, fs in chunk.split_types().items() :
+              self._extend_output(
+                getattr(self, f'process_{lang}', self.process_)(fs)
+              )
+        elif isinstance(dep, ninja.Target) :
+          self._extend_output(self.process_target(dep))
+        else:
+          ValueError(f'This node type is not ({self.__class__.__name__}) is not able to process ({dep.__class__.__name__}) type')
+      self._frozen = True
+      self._extend_output(self.postprocess())
   
   def process_target(self, tar) -> Iterable[Union[FileSet, ninja.Target]]:
     """
@@ -347,12 +595,14 @@ class Node(object):
     """
     raise ValueError(f'This node type ({self.__class__.__name__}) is not able to process "{fs.conf.lang}" file type')
   
-  @cached_property
+  @property
   def output(self) -> Iterable[Union[FileSet, ninja.Target]]:
     """
-    Freeze the node and get its output
+    Freeze the node and get its output. The lock is per node : threads getting the outputs of different nodes do not wait for each other.
     """
-    self.process()
+    if not self._frozen :
+      with self._lock :
+        self.process()
     return self._output
 
 
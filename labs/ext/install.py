@@ -334,7 +334,6 @@ class Install(Node):
       child_fs = cache.get(f.parent, None)
       if child_fs is None :
         child_fs = FileSet(conf=fs.conf, cwd=fs.cwd)
-        child_fs.conf.install = Dict(child_fs.conf.install) # Avoid sharing keys
         child_fs.conf.install.type = 'gather'
         child_fs.conf.install.sub_path = sub_path / f.parent.relative_to(base_dir)
         cache[f.parent] = child_fs
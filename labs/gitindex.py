@@ -0,0 +1,134 @@
+"""
+Reader of the git index file (.git/index), listing the tracked files without running git.
+See https://git-scm.com/docs/index-format
+"""
+
+import os
+import mmap
+import struct
+
+class GitIndexError(RuntimeError):
+  pass
+
+_header = struct.Struct('>4sLL')
+_mode = struct.Struct('>L')
+_mode_offset = 24
+_stat_size = 40
+_flags = struct.Struct('>H')
+
+_S_IFMT = 0o170000
+_S_IFDIR = 0o040000
+_S_IFGITLINK = 0o160000
+_EXTENDED = 0x4000
+_SKIP_WORKTREE = 0x4000
+_NAME_MASK = 0xfff
+
+def find_repository(path):
+  """
+  Return (work tree root, index path) of the git repository containing path, or None
+  """
+  path = os.path.abspath(path)
+  while True :
+    dot_git = os.path.join(path, '.git')
+    if os.path.isdir(dot_git) :
+      return path, os.path.join(dot_git, 'index')
+    if os.path.isfile(dot_git) :
+      # Linked work tree or submodule : .git is a file pointing to the git dir
+      with open(dot_git, 'r') as f :
+        line = f.readline().strip()
+      if line.startswith('gitdir:') :
+        git_dir = os.path.join(path, line[len('gitdir:'):].strip())
+        return path, os.path.join(git_dir, 'index')
+    parent = os.path.dirname(path)
+    if parent == path :
+      return None
+    path = parent
+
+def _common_dir(git_dir):
+  """
+  The git dir holding the config of git_dir : the main git dir of a linked work tree (.git/worktrees/<name>), git_dir otherwise
+  """
+  try:
+    with open(os.path.join(git_dir, 'commondir'), 'r') as f :
+      common = f.readline().strip()
+  except OSError :
+    return git_dir
+  return os.path.normpath(os.path.join(git_dir, common)) if common else git_dir
+
+def _hash_size(index_path) -> int:
+  config = os.path.join(_common_dir(os.path.dirname(index_path)), 'config')
+  try:
+    with open(config, 'r') as f :
+      for line in f :
+        k, _, v = line.partition('=')
+        if k.strip().lower() == 'objectformat' and v.strip().lower() == 'sha256' :
+          return 32
+  except OSError :
+    pass
+  return 20
+
+def read_index(index_path, hash_size=None) -> list:
+  """
+  Return the paths of the files of the index, relative to the work tree root and '/'-separated, in the index order (sorted).
+  Entries excluded from the work tree (sparse checkout) and submodules are skipped, conflicted paths are listed once.
+  Raise GitIndexError if the file is not a supported index (versions 2 to 4, sparse indexes excepted).
+  """
+  if hash_size is None :
+    hash_size = _hash_size(index_path)
+  with open(index_path, 'rb') as f :
+    if os.fstat(f.fileno()).st_size < _header.size :
+      raise GitIndexError(f'{index_path} : truncated index')
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m :
+      return _parse(m, hash_size, index_path)
+
+def _parse(m, hash_size, index_path) -> list:
+  signature, version, count = _header.unpack_from(m, 0)
+  if signature != b'DIRC' or version not in (2, 3, 4) :
+    raise GitIndexError(f'{index_path} : unsupported index (version {version})')
+  res = []
+  pos = _header.size
+  flags_pos = _stat_size + hash_size
+  name = b''
+  last = None
+  try:
+    for i in range(count) :
+      start = pos
+      mode, = _mode.unpack_from(m, pos + _mode_offset)
+      pos += flags_pos
+      flags, = _flags.unpack_from(m, pos)
+      pos += 2
+      skip = False
+      if flags & _EXTENDED and version >= 3 :
+        skip = _flags.unpack_from(m, pos)[0] & _SKIP_WORKTREE
+        pos += 2
+      if version == 4 :
+        # The path is stored as the number of bytes to remove from the previous one, and the suffix to append
+        c = m[pos]
+        pos += 1
+        strip = c & 0x7f
+        while c & 0x80 :
+          c = m[pos]
+          pos += 1
+          strip = ((strip + 1) << 7) | (c & 0x7f)
+        end = m.find(b'\0', pos)
+        name = name[:len(name) - strip] + m[pos:end]
+        pos = end + 1
+      else:
+        length = flags & _NAME_MASK
+        end = pos + length if length < _NAME_MASK else m.find(b'\0', pos)
+        name = m[pos:end]
+        # NUL padding up to a multiple of 8 bytes
+        pos = start + ((end - start) // 8 + 1) * 8
+      kind = mode & _S_IFMT
+      if kind == _S_IFDIR :
+        raise GitIndexError(f'{index_path} : sparse indexes are not supported')
+      if skip or kind == _S_IFGITLINK or name == last :
+        continue
+      last = name
+      res.append(name)
+  except (struct.error, IndexError) :
+    raise GitIndexError(f'{index_path} : truncated index')
+  if not res :
+    return []
+  # Decoding all the names at once is much faster than one by one
+  return b'\0'.join(res).decode('utf8', 'surrogateescape').split('\0')
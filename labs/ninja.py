@@ -1,7 +1,8 @@
 from pathlib import Path
-from itertools import chain
+from itertools import chain, groupby
 import operator as op
-from .utils import Dict
+import re
+from .utils import Dict, gc_paused
 import shlex
 from collections import namedtuple
 from typing import Callable
@@ -27,6 +28,7 @@ def _defOps(a, loc):
     if not isinstance(oth, self.__class__) :
       oth = self.__class__(oth)
     getattr(op, _iop)(self.paths, oth.paths)
+    self._ninja = None
     return self
   o.__name__ = _op
   ro.__name__ = _rop
@@ -41,6 +43,8 @@ class Target(object):
   """
   Set of explicit/implicit input/output files
   """
+  _ninja = None # Cache of toNinja(), reset by the in-place operators
+
   def __init__(self, *args):
     if len(args) == 1 and isinstance(args[0], Target) :
       self.paths = set(args[0].paths)
@@ -72,70 +76,135 @@ class Target(object):
   def str_sorted(self):
     return sorted(map(str, self.paths))
 
-  def toNinja(self):
-    return ' '.join(str(e) for e in self.str_sorted())
+  def ninja_paths(self):
+    """
+    The escaped paths, in the order they are written
+    """
+    return sorted( (str(e) if isinstance(e, Expr) else escape(str(e))) for e in self.paths )
+
+  def toNinja(self, rewrite=None):
+    """
+    The escaped paths separated by spaces. rewrite, if given, is applied to each escaped path (the result is not cached then).
+    """
+    if rewrite is not None :
+      return ' '.join(map(rewrite, self.ninja_paths()))
+    res = self._ninja
+    if res is None :
+      res = ' '.join(self.ninja_paths())
+      self._ninja = res
+    return res
       
 del _defOps
 
+class _Concat(object):
+  """
+  Rope node : deferred concatenation of the segments of two expressions
+  """
+  __slots__ = ('left', 'right')
+
+  def __init__(self, left, right):
+    self.left = left
+    self.right = right
+
+def _flatten(rope) -> tuple:
+  if rope.__class__ is tuple :
+    return rope
+  res = []
+  stack = [rope]
+  while stack :
+    n = stack.pop()
+    if n.__class__ is tuple :
+      res.extend(n)
+    else:
+      stack.append(n.right)
+      stack.append(n.left)
+  return tuple(res)
+
+def _concat(left, right):
+  if left.__class__ is tuple and right.__class__ is tuple and len(left) + len(right) <= _concat.max_flat :
+    return left + right
+  return _Concat(left, right)
+_concat.max_flat = 16
+
+
 class Expr(object):
   """
-  Represents a string with reference to a variable
+  Represents a string with reference to a variable.
+  The segments are stored as an immutable rope, shared between expressions. Concatenation is O(1),
+  the escaped string is computed only once, when first needed.
+  An expression is hashed by its string : += returns a new expression, thus the sets and caches (e.g. of Target) holding it stay valid.
   """
+  __slots__ = ('_rope', '_str')
+
   def __init__(self, v):
-    if isinstance(v, self.__class__) :
-      self.value = v.value
+    if isinstance(v, Expr) :
+      self._rope = v._rope
       self._str = v._str
     elif isinstance(v, Path) :
-      self.value = [str(v)]
-      self._recompute_str()
+      self._rope = (str(v),)
+      self._str = None
     elif isinstance(v, (str, Variable)) :
-      self.value = [v]
-      self._recompute_str()
+      self._rope = (v,)
+      self._str = None
     else:
       raise ValueError('Expr() accepts only other exprs, str, or Variable')
-      self.value = None
-      self._str = None
 
   @classmethod
   def is_compatible(cls, obj):
     return isinstance(obj, (Expr, Variable, Path, str))
 
+  @property
+  def value(self) -> tuple:
+    """
+    Segments (str and Variable) of the expression
+    """
+    rope = self._rope
+    if rope.__class__ is not tuple :
+      rope = _flatten(rope)
+      self._rope = rope
+    return rope
+
+  @value.setter
+  def value(self, v):
+    self._rope = tuple(v)
+    self._str = None
+
   def __add__(self, other):
     e = self.__class__(other)
-    e.value = self.value + e.value
-    e._recompute_str()
+    e._rope = _concat(self._rope, e._rope)
+    e._str = None
     return e
     
   def __radd__(self, other):
     e = self.__class__(other)
-    e.value = e.value + self.value
-    e._recompute_str()
+    e._rope = _concat(e._rope, self._rope)
+    e._str = None
     return e
     
-  def __iadd__(self, other):
-    e = self.__class__(other)
-    self.value += e.value
-    self._recompute_str()
-    return self
-
   def _recompute_str(self):
-    self._str = ''.join(escape(s) if isinstance(s, str) else str(s) for s in self.value)
+    # Consecutive str segments are escaped together
+    self._str = ''.join(
+      escape(''.join(g)) if is_str else ''.join(map(str, g))
+      for is_str, g in groupby(self.value, _is_str)
+    )
     
   def __str__(self):
+    if self._str is None :
+      self._recompute_str()
     return self._str
 
   def __eq__(self, oth):
     if not isinstance(oth, self.__class__) :
       return NotImplemented
-    return self._str == oth._str
+    return str(self) == str(oth)
 
   def __hash__(self):
-    return hash(self._str)
+    return hash(str(self))
 
   def __lt__(self, oth):
     if not isinstance(oth, self.__class__) :
       return NotImplemented
-    return self._str < oth._str
+    return str(self) < str(oth)
     
 
 class Variable(object):
@@ -162,6 +231,37 @@ class VariableBuiltin(Variable):
   def toNinja(self):
     raise NotImplementedError()
 
+class Pool(str):
+  """
+  A pool of ninja, limiting the number of jobs run concurrently by the rules and builds whose pool variable is set to it.
+  The pool is its name, thus it can be used as the value of a variable. The builtin console pool (see console) is not declared, its depth is always 1.
+  """
+  def __new__(cls, name, depth=1):
+    self = super().__new__(cls, name)
+    self.depth = int(depth)
+    if self.depth < 1 :
+      raise ValueError(f'The depth of the pool {name} must be at least 1, not {depth}')
+    if name == 'console' :
+      self.depth = 1
+    return self
+
+  @property
+  def name(self) -> str:
+    return str(self)
+
+  @property
+  def builtin(self) -> bool:
+    return self.name in builtin_pools
+
+  def __repr__(self):
+    return f'Pool({self.name!r}, {self.depth})'
+
+  def toNinja(self):
+    return f'pool {self.name}\n  depth = {self.depth}'
+
+console = Pool('console', 1) # Jobs with direct access to the terminal, run one at a time
+builtin_pools = { console.name : console }
+
 class BuildTarget(object):
   """
   """
@@ -299,6 +399,10 @@ class Build(dict):
     return self.rule[k].value
 
   def __getattr__(self, k):
+    cls = _lazy_build_targets.get(k)
+    if cls is not None :
+      res = self.__dict__[k] = cls()
+      return res
     return self[k]
 
   def __setattr__(self, k, val):
@@ -322,26 +426,89 @@ class Build(dict):
   __rlshift__ = __rshift__
     
 
-  def toNinja(self):
-    variables = ''.join(f'\n  {k} = {str(Expr(v))}' for (k, v) in self.items())
-    if len(self.explicit.o) == 0 and len(self.implicit.o) == 0 :
+  def outputs(self):
+    """
+    Iterate over the explicit then implicit outputs
+    """
+    implicit = self.__dict__.get('implicit')
+    if implicit is None :
+      return iter(self.explicit.o.paths)
+    return chain(self.explicit.o.paths, implicit.o.paths)
+
+  def iter_ninja(self, rule_name=None, skip_variables=(), rewrite=None, inputs=None):
+    """
+    Generate the build statement as a sequence of str chunks.
+    The rule can be written under another name, the variables in skip_variables are not written, and rewrite is applied to the paths (see Target.toNinja).
+    inputs, if given, is the pair of the implicit and order-only inputs written instead of the ones of the build (escaped str, or None for none).
+    """
+    d = self.__dict__
+    implicit = d.get('implicit') or _no_build_target
+    order_only = d.get('order_only') or _no_build_target
+    if len(self.explicit.o) == 0 and len(implicit.o) == 0 :
       raise RuntimeError('This build rule has no output')
-      
-    return (
-      "build "
-      f"{self.explicit.o.toNinja()}"
-      f"{( ' | '  + self.implicit.o.toNinja())   if self.implicit.o   else ''}"
-      " : "
-      f"{self.rule.name} "
-      f"{self.explicit.i.toNinja()}"
-      f"{( ' | '  + self.implicit.i.toNinja())   if self.implicit.i   else ''}"
-      f"{( ' || ' + self.order_only.i.toNinja()) if self.order_only.i else ''}"
-      f"{variables}"
-    )
+    yield 'build '
+    yield self.explicit.o.toNinja(rewrite)
+    if implicit.o :
+      yield ' | '
+      yield implicit.o.toNinja(rewrite)
+    yield ' : '
+    yield self.rule.name if rule_name is None else rule_name
+    yield ' '
+    yield self.explicit.i.toNinja(rewrite)
+    if inputs is None :
+      inputs = (implicit.i.toNinja(rewrite) if implicit.i else None, order_only.i.toNinja(rewrite) if order_only.i else None)
+    if inputs[0] :
+      yield ' | '
+      yield inputs[0]
+    if inputs[1] :
+      yield ' || '
+      yield inputs[1]
+    for k, v in self.items() :
+      if k not in skip_variables :
+        yield f'\n  {k} = {str(Expr(v))}'
+
+  def toNinja(self):
+    return ''.join(self.iter_ninja())
 
   def __repr__(self):
     return self.toNinja()
 
+  @classmethod
+  def _new(cls, rule, variables:dict, i:Expr, o:Expr) -> 'Build':
+    """
+    Build of rule from the explicit input i to the explicit output o, bypassing __init__ and the Target constructors.
+    The implicit and order_only targets are created when first accessed.
+    """
+    b = cls.__new__(cls)
+    dict.update(b, variables)
+    d = b.__dict__
+    d['rule'] = rule
+    bt = BuildTarget.__new__(BuildTarget)
+    t = Target.__new__(Target)
+    t.paths = {i}
+    bt.i = t
+    t = Target.__new__(Target)
+    t.paths = {o}
+    bt.o = t
+    d['explicit'] = bt
+    return b
+
+def _inline(e:Expr, values:dict) -> Expr:
+  """
+  e with the references to the variables named in values replaced by their str value
+  """
+  if not values :
+    return e
+  segments = e.value
+  if not any( isinstance(x, Variable) and x.name in values for x in segments ) :
+    return e
+  res = Expr('')
+  res.value = [ (values[x.name] if isinstance(x, Variable) and x.name in values else x) for x in segments ]
+  return res
+
+_lazy_build_targets = { 'implicit' : BuildTarget, 'order_only' : BuildInputTarget }
+_no_build_target = BuildTarget() # Read-only stand-in for the targets not created yet
+
 class Rule():
   """
   Rule section of ninja
@@ -365,15 +532,58 @@ class Rule():
     super().__init_subclass__(**kwargs)
     cls.Build = Build_cls
 
-  def toNinja(self):
+  def toNinja(self, name=None, inline={}):
+    """
+    The rule statement. It can be written under another name, and with the references to the variables of inline replaced by their value (a str).
+    """
     if 'command' not in self._b :
       raise RuntimeError(f"Missing the required 'command' variable in the rule {self.name} : {repr(self)}")
-    variables = ''.join(f'\n  {k} = {str(Expr(v.value))}' for (k, v) in self._b.items())
-    return f'rule {self.name}{variables}'
+    variables = ''.join(f'\n  {k} = {str(_inline(Expr(v.value), inline))}' for (k, v) in self._b.items())
+    return f'rule {self.name if name is None else name}{variables}'
 
   def build(self, **kwargs):
     return self.Build(self, **kwargs)
 
+  def build_each(self, inputs, outputs, **kwargs) -> list:
+    """
+    Create one build per path of inputs, and return them.
+    outputs gives the output of each build : either a str.format template, with the fields path, dir ('.' for a top-level path), name, stem, suffix
+    and base (path without suffix) of the input path (e.g. '{base}.o'), or a callable mapping the input path str to the output path.
+    The paths given to outputs are not escaped. The variables referenced by an Expr input are written '${name}', and kept as variables in the output.
+    The build variables kwargs are shared by all the builds.
+    """
+    if isinstance(outputs, str) :
+      outputs = _output_template(outputs)
+    if isinstance(inputs, Target) :
+      # A plain Target holds Expr, and maybe Path
+      inputs = sorted(inputs.paths, key=str) if type(inputs).str_sorted is Target.str_sorted else inputs.str_sorted()
+    if self.Build.__init__ is not Build.__init__ :
+      res = []
+      for i in inputs :
+        b = self.Build(self, **kwargs)
+        i, o = _each_output(i, outputs)
+        explicit(i) >> b >> explicit(o)
+        res.append(b)
+      return res
+    new = self.Build._new
+    expr_new = Expr.__new__
+    res = []
+    with gc_paused() :
+      for i in inputs :
+        if isinstance(i, Expr) :
+          i, e = _each_output(i, outputs)
+        else:
+          s = str(i)
+          i = expr_new(Expr)
+          i._rope = (s,)
+          i._str = escape(s)
+          o = str(outputs(s))
+          e = expr_new(Expr)
+          e._rope = (o,)
+          e._str = escape(o)
+        res.append(new(self, kwargs, i, e))
+    return res
+
   def __repr__(self):
     variables = ''.join(f'\n  {k} = {str(Expr(v.value))}' for (k, v) in self.items())
     return f'rule {self.name}{variables}'
@@ -413,6 +623,38 @@ class Rule():
     return res
 
 
+def _each_output(i, outputs) -> tuple:
+  """
+  The (input, output) Expr of a build of Rule.build_each, from the input path i
+  """
+  i = Expr(i)
+  segments = i.value
+  raw = ''.join(map(str, segments))
+  o = str(outputs(raw))
+  variables = { x.name : x for x in segments if isinstance(x, Variable) }
+  if not variables :
+    return i, Expr(o)
+  # Restore the variables written ${name} by the raw path
+  parts = re.split('\\$\\{(' + '|'.join(map(re.escape, variables)) + ')\\}', o)
+  e = Expr('')
+  e.value = [ (variables[x] if k % 2 else x) for k, x in enumerate(parts) if x ]
+  return i, e
+
+def _output_template(template:str) -> Callable[[str], str]:
+  fmt = template.format
+  def output(p):
+    d, _, name = p.rpartition('/')
+    stem, dot, suffix = name.rpartition('.')
+    if not dot :
+      stem, suffix = name, ''
+    base = p[:len(p) - len(suffix) - bool(dot)]
+    if not d and not p.startswith('/') :
+      # The dir of a top-level input is '.', and '{dir}/...' gives a path relative to it, not to the filesystem root
+      res = fmt(path=p, dir='.', name=name, stem=stem, suffix=suffix, base=base)
+      return res[2:] if res.startswith('./') else res
+    return fmt(path=p, dir=d, name=name, stem=stem, suffix=suffix, base=base)
+  return output
+
 def explicit(*args):
   return QualifiedTarget(explicit=Target(*args))
 def implicit(*args):
@@ -420,15 +662,30 @@ def implicit(*args):
 def order_only(*args):
   return QualifiedTarget(order_only=Target(*args))
 
+_escape_table = str.maketrans({
+  '$' : '$$',
+  ' ' : '$ ',
+  ':' : '$:',
+  '\n': '$\n',
+})
+_needs_escape = re.compile('[$ :\n]').search
+
+def _is_str(s):
+  return isinstance(s, str)
+
 def escape(s):
-  for k, v in [
-    ('$' , '$$'),
-    (' ' , '$ '),
-    (':' , '$:'),
-    ('\n', '$\n'),
-  ]:
-    s = s.replace(k, v)
-  return s
+  if _needs_escape(s) is None :
+    return s
+  return s.translate(_escape_table)
+
+def escape_join(strs, sep=' '):
+  """
+  Escape all the strings of strs and join them with sep (which is not escaped), in a single pass over the whole result.
+  """
+  s = '\0'.join(strs)
+  if _needs_escape(s) is not None :
+    s = s.translate(_escape_table)
+  return s.replace('\0', sep)
 
 def quote_arg_list(*args, variable_factory:Callable[[str, Expr], Variable]=None) -> Expr:
   if len(args) == 1 and not isinstance(args[0], (str, Variable)) :
@@ -483,6 +740,7 @@ v_generator = VariableBuiltin('generator')
 v_in = VariableBuiltin('in')
 v_in_newline = VariableBuiltin('in_newline')
 v_out = VariableBuiltin('out')
+v_pool = VariableBuiltin('pool')
 v_restat = VariableBuiltin('restat')
 v_rspfile = VariableBuiltin('rspfile')
 v_rspfile_content = VariableBuiltin('rspfile_content')
@@ -498,6 +756,7 @@ builtin_variables = { v.name : v for v in (
   v_in,
   v_in_newline,
   v_out,
+  v_pool,
   v_restat,
   v_rspfile,
   v_rspfile_content
@@ -511,10 +770,13 @@ __all__ = [
   'Variable',
   'Build',
   'Rule',
+  'Pool',
+  'console',
   'explicit',
   'implicit',
   'order_only',
   'escape',
+  'escape_join',
   'quote_arg_list',
   'FutureVariable',
   'V',
@@ -0,0 +1,186 @@
+"""
+Statistics of a ninja build : the ninja log (.ninja_log) joined with the build graph written by labs at configure time (see Project.graph).
+"""
+
+import json
+from collections import namedtuple
+from .utils import Graph, cpu_count
+
+class NinjaLogError(RuntimeError):
+  pass
+
+LogEntry = namedtuple('LogEntry', ('start', 'end', 'output'))
+
+_log_header = '# ninja log v'
+
+def read_ninja_log(path) -> list:
+  """
+  Return the runs of ninja recorded in the ninja log path, each one the list of its LogEntry in the log order.
+  The times are in ms from the start of the run. ninja appends the entry of an edge when it ends, thus a new run starts when an output
+  repeats in the current run, or when the start times reset : an edge ending before the previous entry started belongs to a later run.
+  A recompacted log starts with the last entry of each output of the former runs, in any order : they may be grouped in arbitrary runs,
+  but the runs appended afterwards are not mixed with them.
+  Raise NinjaLogError if the file is not a ninja log of version 5 or more.
+  """
+  with open(path, 'r', encoding='utf8', errors='surrogateescape') as f :
+    header = f.readline()
+    try:
+      if not header.startswith(_log_header) or int(header[len(_log_header):]) < 5 :
+        raise ValueError()
+    except ValueError :
+      raise NinjaLogError(f'{path} : unsupported ninja log ({header.strip()!r})')
+    runs = []
+    run = None
+    outputs = set()
+    last = None
+    for line in f :
+      fields = line.rstrip('\n').split('\t')
+      if len(fields) < 5 :
+        continue
+      try:
+        start, end = int(fields[0]), int(fields[1])
+      except ValueError :
+        continue
+      output = fields[3]
+      if run is None or output in outputs or end < last.start :
+        run = []
+        runs.append(run)
+        outputs = set()
+      last = LogEntry(start, end, output)
+      run.append(last)
+      outputs.add(output)
+  return runs
+
+def latest_entries(runs) -> list:
+  """
+  The last LogEntry of each output over all the runs. Their times are relative to different runs.
+  """
+  entries = {}
+  for run in runs :
+    for e in run :
+      entries.pop(e.output, None)
+      entries[e.output] = e
+  return list(entries.values())
+
+def read_graph(path) -> dict:
+  with open(path, 'r') as f :
+    graph = json.load(f)
+  if graph.get('version') != 1 :
+    raise ValueError(f'{path} : unsupported build graph version {graph.get("version")}')
+  return graph
+
+def _totals(edges, key) -> list:
+  res = {}
+  for e in edges :
+    name = e[key]
+    t = res.get(name)
+    if t is None :
+      t = res[name] = { 'name' : name, 'count' : 0, 'total' : 0, 'max' : 0 }
+    t['count'] += 1
+    t['total'] += e['duration']
+    t['max'] = max(t['max'], e['duration'])
+  return sorted(res.values(), key=lambda t: (-t['total'], str(t['name'])))
+
+def analyze(entries, graph:dict, jobs=None, top=10, timeline=True) -> dict:
+  """
+  Statistics of the edges run, from the log entries and the build graph. An edge is the run of a build, its duration is attributed to its rule and its node.
+  The outputs unknown to the graph (e.g. written by a stale configuration) are edges with the rule and the node None.
+  The parallelism is the time spent in the edges over the wall time, the utilization is the parallelism over jobs (the number of CPUs by default).
+  The critical path is the chain of dependent edges of longest total duration. The durations and times are in ms.
+  These timeline statistics are only meaningful for the entries of a single run : they are None unless timeline is set.
+  """
+  builds = graph['builds']
+  index = { o : i for i, b in enumerate(builds) for o in b['outputs'] }
+  # The outputs of a build are logged with the same times : one edge per build
+  edges = {}
+  for e in entries :
+    i = index.get(e.output)
+    key = e.output if i is None else i
+    if key in edges :
+      continue
+    b = builds[i] if i is not None else { 'rule' : None, 'node' : None }
+    edges[key] = {
+      'output' : e.output,
+      'rule' : b['rule'],
+      'node' : b['node'],
+      'start' : e.start,
+      'end' : e.end,
+      'duration' : e.end - e.start,
+    }
+  if jobs is None :
+    jobs = cpu_count()
+  values = list(edges.values())
+  busy = sum( e['duration'] for e in values )
+  wall = parallelism = utilization = path = None
+  if timeline :
+    wall = (max( e['end'] for e in values ) - min( e['start'] for e in values )) if values else 0
+    parallelism = busy / wall if wall else 0.
+    utilization = parallelism / jobs
+    path = critical_path(edges, builds)
+  return {
+    'edges' : len(values),
+    'unknown' : sum( e['rule'] is None for e in values ),
+    'wall' : wall,
+    'busy' : busy,
+    'jobs' : jobs,
+    'parallelism' : parallelism,
+    'utilization' : utilization,
+    'critical_path' : path,
+    'rules' : _totals(values, 'rule'),
+    'nodes' : _totals(values, 'node'),
+    'top' : sorted(values, key=lambda e: (-e['duration'], e['output']))[:top],
+  }
+
+def critical_path(edges:dict, builds:list) -> dict:
+  """
+  The chain of dependent edges (edges maps build indexes to edges) of longest total duration.
+  The builds which did not run are crossed at no cost, since they can relay a dependency between edges.
+  """
+  g = Graph(range(len(builds)), lambda i: builds[i]['deps'])
+  length = [0] * len(builds)
+  previous = [None] * len(builds)
+  for i in g.topologicalSort(False) :
+    best = None
+    for d in builds[i]['deps'] :
+      if best is None or length[d] > length[best] :
+        best = d
+    e = edges.get(i)
+    length[i] = (e['duration'] if e else 0) + (length[best] if best is not None else 0)
+    previous[i] = best
+  path = []
+  if builds :
+    i = max(range(len(builds)), key=length.__getitem__)
+    while i is not None :
+      if i in edges :
+        path.append(edges[i])
+      i = previous[i]
+  path.reverse()
+  return { 'duration' : sum( e['duration'] for e in path ), 'edges' : path }
+
+def _s(ms) -> str:
+  return f'{ms / 1000:.3f} s'
+
+def format_text(stats:dict, top=10) -> str:
+  """
+  Human readable report of the statistics of analyze, with the top rules and nodes
+  """
+  unknown = f" ({stats['unknown']} unknown to the build graph)" if stats['unknown'] else ''
+  path = stats['critical_path']
+  if path is None :
+    lines = [ f"{stats['edges']} edges run over several runs, {_s(stats['busy'])} busy" + unknown ]
+  else:
+    lines = [
+      f"{stats['edges']} edges run in {_s(stats['wall'])}, {_s(stats['busy'])} busy" + unknown,
+      f"Parallelism : {stats['parallelism']:.2f} of {stats['jobs']} jobs ({stats['utilization']:.0%} utilization)",
+      '',
+      f"Critical path : {_s(path['duration'])}",
+    ]
+    lines.extend( f"  {_s(e['duration']):>12}  {e['output']}  [{e['rule']}]" for e in path['edges'] )
+  for title, key in (('Rules', 'rules'), ('Nodes', 'nodes')) :
+    lines.append('')
+    lines.append(f'{title} (count, total, max) :')
+    lines.extend( f"  {t['count']:>6} {_s(t['total']):>12} {_s(t['max']):>12}  {t['name']}" for t in stats[key][:top] )
+  lines.append('')
+  lines.append('Longest edges :')
+  lines.extend( f"  {_s(e['duration']):>12}  {e['output']}  [{e['rule']}, {e['node']}]" for e in stats['top'] )
+  return '\n'.join(lines) + '\n'
@@ -1,4 +1,14 @@
-from collections import deque, defaultdict
+import os
+import json
+import hashlib
+import threading
+import gc
+from contextlib import contextmanager
+from pathlib import Path
+from array import array
+from heapq import heappush, heappop
+from itertools import accumulate, repeat, chain
+from collections import defaultdict
 from addict import Dict
 
 class DefaultDict(defaultdict):
@@ -8,54 +18,480 @@ class DefaultDict(defaultdict):
     return res
 
 class Graph(object):
+  """
+  Directed graph over hashable vertices, stored as integer arrays in compressed sparse row layout :
+  the neighbors of the vertex i are self.targets[self.offsets[i]:self.offsets[i+1]].
+  The vertices are numbered in order of first appearance in iterable, then as neighbors.
+  """
   class CycleError(RuntimeError):
-    pass
+    def __init__(self, cycle):
+      super().__init__('Cycle : ' + ' -> '.join(map(repr, cycle)))
+      self.cycle = cycle
 
-  class Node(object):
-    def __init__(self, data):
-      self.data = data
-      self.adj = []
-      self.state = None
-      
   def __init__(self, iterable, neighbors_cb):
-    node = DefaultDict(lambda n: self.Node(n))
-    for n in iterable :
-      n_n = node[n]
-      for u in neighbors_cb(n) :
-        n_n.adj.append(node[u])
-    self.node = node
-
-  def topologicalSort(self, reverse = True):
-    VISITED = object()
-    PROCESSED = object()
-    d = deque()
-    s = deque()
-    for n in self.node.values() :
-      if n.state == None :
-        s.append((False, n))
-        n.state = VISITED
-      while s :
-        end, n = s.pop()
-        if end :
-          d.append(n.data)
-          n.state = PROCESSED
-        else:
-          s.append((True, n))
-          for u in n.adj :
-            if u.state is PROCESSED :
-              continue
-            if u.state is VISITED :
-              raise self.CycleError(u)
-            s.append((False, u))
-            u.state = VISITED
+    vertices = list(dict.fromkeys(iterable))
+    index = { v : i for i, v in enumerate(vertices) }
+    get = index.get
+    offsets = array('q', [0])
+    targets = array('q')
+    for v in vertices[:] :
+      ids = list(map(get, neighbors_cb(v)))
+      if None in ids :
+        ids = [ _vertex_id(index, vertices, u) for u in neighbors_cb(v) ]
+      targets.extend(ids)
+      offsets.append(len(targets))
+    offsets.extend(repeat(len(targets), len(vertices) + 1 - len(offsets)))
+    self.index = index
+    self.vertices = vertices
+    self.offsets = offsets
+    self.targets = targets
+
+  def __len__(self):
+    return len(self.vertices)
+
+  def transposed(self):
+    """
+    Return (offsets, sources) : the CSR arrays of the graph with the edges reversed. The predecessors of each vertex are in increasing order.
+    """
+    n = len(self.vertices)
+    offsets, targets = self.offsets, self.targets
+    counts = [0] * (n + 1)
+    for t in targets :
+      counts[t + 1] += 1
+    t_offsets = array('q', accumulate(counts))
+    pos = list(t_offsets[:-1])
+    sources = array('q', bytes(8 * len(targets)))
+    for i in range(n) :
+      for t in targets[offsets[i]:offsets[i + 1]] :
+        sources[pos[t]] = i
+        pos[t] += 1
+    return t_offsets, sources
+
+  def topologicalSort(self, reverse=True) -> list:
+    """
+    Sort the vertices with Kahn's algorithm. If reverse, each vertex comes before its neighbors, otherwise after them.
+    Among the vertices ready at the same time, the first appeared comes first.
+    Raise a CycleError naming the vertices of a cycle if there is one.
+    """
+    n = len(self.vertices)
     if reverse :
-      return reversed(d)
+      offsets, targets = self.offsets, self.targets
+      degree = [0] * n
+      for t in targets :
+        degree[t] += 1
     else:
-      return d
-  
-  
+      offsets, targets = self.transposed()
+      o = self.offsets
+      degree = [ o[i + 1] - o[i] for i in range(n) ]
+    ready = [ i for i in range(n) if degree[i] == 0 ]
+    order = []
+    append = order.append
+    while ready :
+      i = heappop(ready)
+      append(i)
+      for t in targets[offsets[i]:offsets[i + 1]] :
+        degree[t] -= 1
+        if degree[t] == 0 :
+          heappush(ready, t)
+    if len(order) < n :
+      if reverse :
+        cycle = _find_cycle(degree, *self.transposed())
+      else:
+        cycle = _find_cycle(degree, self.offsets, self.targets)
+        cycle.reverse()
+      raise self.CycleError([ self.vertices[i] for i in cycle ])
+    vertices = self.vertices
+    return [ vertices[i] for i in order ]
+
+def _vertex_id(index, vertices, v):
+  i = index.get(v)
+  if i is None :
+    i = index[v] = len(vertices)
+    vertices.append(v)
+  return i
+
+def _find_cycle(degree, offsets, sources) -> list:
+  """
+  Return a cycle among the vertices left by Kahn's algorithm (those with a positive degree), walking the edges (offsets, sources) backward.
+  """
+  i = next( i for i, d in enumerate(degree) if d > 0 )
+  seen = {}
+  path = []
+  while i not in seen :
+    seen[i] = len(path)
+    path.append(i)
+    i = next( s for s in sources[offsets[i]:offsets[i + 1]] if degree[s] > 0 )
+  cycle = path[seen[i]:]
+  cycle.reverse()
+  return cycle
+
 def dict2Graph(d:dict) -> Graph:
   return Graph(d.keys(), d.__getitem__)
-      
 
 
+def _batches(chunks, batch_size=4096):
+  batch = []
+  append = batch.append
+  for c in chunks :
+    append(c)
+    if len(batch) >= batch_size :
+      yield batch
+      batch = []
+      append = batch.append
+  if batch :
+    yield batch
+
+def write_chunks(f, chunks, batch_size=4096):
+  """
+  Write an iterable of str chunks to the file-like f, batching them through f.writelines.
+  At most batch_size chunks are kept in memory.
+  """
+  for batch in _batches(chunks, batch_size) :
+    f.writelines(batch)
+
+def _file_digest(path:Path, block_size=1 << 20):
+  h = hashlib.sha256()
+  with path.open('rb') as f :
+    while (b := f.read(block_size)) :
+      h.update(b)
+  return h.digest()
+
+def write_if_changed(path:Path, chunks, encoding='utf8') -> bool:
+  """
+  Write the str chunks to path, only if the content differs from the existing file.
+  The content is first written to a temporary file in the same directory, and atomically renamed to path if it changed.
+  Thus, an unchanged file keeps its mtime, and a reader never sees a partially written file.
+  @return True if the file has been (re)written.
+  """
+  path = Path(path)
+  tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+  try:
+    with tmp.open('w', encoding=encoding, newline='') as f :
+      write_chunks(f, chunks)
+    try:
+      changed = (
+        path.stat().st_size != tmp.stat().st_size or
+        _file_digest(path) != _file_digest(tmp)
+      )
+    except FileNotFoundError:
+      changed = True
+    if changed :
+      os.replace(tmp, path)
+    return changed
+  finally:
+    if tmp.exists() :
+      tmp.unlink()
+
+def stat_signature(paths) -> list:
+  """
+  Return [path, mtime_ns, size] for each path, with None for the missing ones. Cheap enough to be computed on every run.
+  """
+  res = []
+  for p in paths :
+    try:
+      st = os.stat(p)
+      res.append([str(p), st.st_mtime_ns, st.st_size])
+    except OSError :
+      res.append([str(p), None, None])
+  return res
+
+@contextmanager
+def gc_paused():
+  """
+  Disable the cyclic garbage collector in the block. Allocating many long-lived objects otherwise triggers collections
+  that only walk the growing heap.
+  """
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if enabled :
+      gc.enable()
+
+def cpu_count() -> int:
+  """
+  Number of CPUs the process can run on
+  """
+  try:
+    return len(os.sched_getaffinity(0)) or 1
+  except (AttributeError, OSError) :
+    return os.cpu_count() or 1
+
+def total_memory():
+  """
+  Physical memory of the machine, in bytes, or None if unknown.
+  Unlike the available memory, it does not change between runs, thus the values computed from it are reproducible.
+  """
+  try:
+    with open('/proc/meminfo', 'r') as f :
+      for line in f :
+        if line.startswith('MemTotal:') :
+          return int(line.split()[1]) * 1024
+  except (OSError, ValueError, IndexError) :
+    pass
+  try:
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+  except (AttributeError, ValueError, OSError) :
+    return None
+
+def pool_depth(memory_per_job=None, cpus_per_job=1, max_depth=None) -> int:
+  """
+  Number of jobs that can run concurrently, each using cpus_per_job CPUs and memory_per_job bytes (if not None) of the total memory, at least 1
+  """
+  depth = int(cpu_count() // cpus_per_job)
+  if memory_per_job :
+    memory = total_memory()
+    if memory is not None :
+      depth = min(depth, int(memory // memory_per_job))
+  if max_depth is not None :
+    depth = min(depth, max_depth)
+  return max(depth, 1)
+
+class PathIndex(object):
+  """
+  Index of the entries of the directories of a PATH, to find executables as shutil.which does.
+  A directory is listed (with a single scandir) the first time a lookup reaches it, and listed again only when its mtime changed,
+  thus programs installed or removed meanwhile are seen by long-lived processes.
+  """
+  def __init__(self, path:str=None):
+    if path is None :
+      path = os.environ.get('PATH', os.defpath)
+    self.path = path
+    self.dirs = list(dict.fromkeys( d for d in path.split(os.pathsep) if d ))
+    self._entries = {} # dir -> (st_mtime_ns, set of the names it contains)
+
+  def _names(self, d):
+    try:
+      mtime = os.stat(d).st_mtime_ns
+    except OSError :
+      return ()
+    res = self._entries.get(d)
+    if res is None or res[0] != mtime :
+      try:
+        with os.scandir(d) as it :
+          res = (mtime, { e.name for e in it })
+      except OSError :
+        res = (mtime, set())
+      self._entries[d] = res
+    return res[1]
+
+  def which(self, name:str):
+    """
+    Return the path of the executable name, or None if it is not found
+    """
+    if os.sep in name :
+      return name if _is_executable(name) else None
+    for d in self.dirs :
+      if name in self._names(d) :
+        p = os.path.join(d, name)
+        if _is_executable(p) :
+          return p
+    return None
+
+def _is_executable(p):
+  return os.path.isfile(p) and os.access(p, os.X_OK)
+
+_path_index = None
+
+def path_index() -> PathIndex:
+  """
+  Return the process-wide index of the current PATH. It is rebuilt when PATH changes.
+  """
+  global _path_index
+  path = os.environ.get('PATH', os.defpath)
+  if _path_index is None or _path_index.path != path :
+    _path_index = PathIndex(path)
+  return _path_index
+
+def which(name:str):
+  """
+  Same as shutil.which, using path_index()
+  """
+  return path_index().which(name)
+
+class JsonCache(object):
+  """
+  Thread-safe key -> value store, persisted in a json file.
+  Only the entries read or written since the load are saved back, unless keep_all is set, in which case the entries are merged with the ones in the file.
+  """
+  def __init__(self, path:Path=None, keep_all=False):
+    self.path = path
+    self.keep_all = keep_all
+    self._data = {}
+    self._used = {}
+    self._lock = threading.Lock()
+
+  def _read(self):
+    try:
+      with self.path.open('r') as f :
+        data = json.load(f)
+    except (OSError, ValueError) :
+      return {}
+    return data if isinstance(data, dict) else {}
+
+  def load(self):
+    data = self._read()
+    with self._lock :
+      self._data.update(data)
+
+  def get(self, key, default=None):
+    with self._lock :
+      try:
+        res = self._used[key] = self._data[key]
+        return res
+      except KeyError :
+        return default
+
+  def __setitem__(self, key, value):
+    with self._lock :
+      self._data[key] = self._used[key] = value
+
+  def save(self):
+    if self.path is None :
+      return
+    if self.keep_all :
+      # Other processes may have stored entries since the load
+      data = self._read()
+      with self._lock :
+        data.update(self._data)
+    else:
+      with self._lock :
+        data = dict(self._used)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    write_if_changed(self.path, [json.dumps(data, sort_keys=True)])
+
+class ConfDict(Dict):
+  """
+  Copy-on-write configuration : the keys missing in this (local) layer are read from a base mapping, shared and never modified through this object.
+  A nested dict of the base is read through a new ConfDict layer over it, which is only stored in the local layer when written to.
+  A list, set or bytearray of the base is copied in the local layer when first read, since it can be modified in place.
+  Thus, forking a configuration is O(1), and only the overriden or mutable keys take memory.
+  """
+  _copied_types = (list, set, bytearray)
+
+  def __init__(self, *args, base=None, **kwargs):
+    object.__setattr__(self, '_base', base)
+    super().__init__(*args, **kwargs)
+
+  def __missing__(self, name):
+    base = self._base
+    if base is not None and name in base :
+      v = base[name]
+      if isinstance(v, dict) :
+        return self.__class__(base=v, __parent=self, __key=name)
+      if isinstance(v, self._copied_types) :
+        v = v.copy()
+        self[name] = v
+      return v
+    return super().__missing__(name)
+
+  def _is_empty_layer(self):
+    return self._base is not None and dict.__len__(self) == 0
+
+  def __contains__(self, k):
+    return dict.__contains__(self, k) or (self._base is not None and k in self._base)
+
+  def get(self, k, default=None):
+    if k in self :
+      return self[k]
+    return default
+
+  def keys(self):
+    base = self._base
+    if base is None :
+      return list(dict.keys(self))
+    return list(dict.fromkeys(chain(base.keys(), dict.keys(self))))
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    if self._base is None :
+      return dict.__len__(self)
+    return len(self.keys())
+
+  def items(self):
+    return [ (k, self[k]) for k in self.keys() ]
+
+  def values(self):
+    return [ self[k] for k in self.keys() ]
+
+  def __eq__(self, oth):
+    if not isinstance(oth, dict) :
+      return NotImplemented
+    return len(self) == len(oth) and all( k in oth and oth[k] == v for k, v in self.items() )
+
+  def __ne__(self, oth):
+    res = self.__eq__(oth)
+    return res if res is NotImplemented else not res
+
+  __hash__ = None
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+  def flatten(self):
+    """
+    Copy the keys of the base in the local layer, and detach self from the base.
+    """
+    base = self._base
+    if base is None :
+      return
+    for k in list(base.keys()) :
+      if not dict.__contains__(self, k) :
+        v = base[k]
+        dict.__setitem__(self, k, self.__class__(base=v) if isinstance(v, dict) else v.copy() if isinstance(v, self._copied_types) else v)
+    object.__setattr__(self, '_base', None)
+
+  def __delitem__(self, k):
+    self.flatten()
+    dict.__delitem__(self, k)
+
+  def pop(self, k, *args):
+    self.flatten()
+    return dict.pop(self, k, *args)
+
+  def popitem(self):
+    self.flatten()
+    return dict.popitem(self)
+
+  def clear(self):
+    object.__setattr__(self, '_base', None)
+    dict.clear(self)
+
+  def update(self, *args, **kwargs):
+    other = {}
+    if args :
+      if len(args) > 1 :
+        raise TypeError()
+      other.update(args[0])
+    other.update(kwargs)
+    for k, v in other.items() :
+      if k in self and isinstance(v, dict) and isinstance(self[k], dict) :
+        self[k].update(v)
+      elif isinstance(v, dict) :
+        self[k] = self.__class__(base=v) # Share v instead of copying it
+      else:
+        self[k] = v
+
+  def copy(self):
+    """
+    A copy of the current content, not affected by the later changes of self
+    """
+    return self.__class__(self.to_dict())
+
+  def to_dict(self):
+    return { k : (v.to_dict() if isinstance(v, Dict) else v) for k, v in self.items() }
+
+  def __reduce__(self):
+    return (self.__class__, (self.to_dict(),))
+
+  def fork(self):
+    """
+    Return (self_layer, copy) : two copy-on-write layers over the current content of self.
+    Use self_layer in place of self from now on, so that the changes of each one are not seen by the other.
+    """
+    base = self._base if self._is_empty_layer() else self
+    self_layer = self if base is not self else self.__class__(base=base)
+    return self_layer, self.__class__(base=base)
@@ -0,0 +1,230 @@
+"""
+Directory walker matching many glob patterns in a single traversal.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+class _Pattern(object):
+  """
+  A compiled glob pattern. See Walker for the syntax.
+  """
+  def __init__(self, pattern:str):
+    pattern = str(pattern).replace(os.sep, '/')
+    if not pattern or pattern.startswith('/') :
+      raise ValueError(f'Unacceptable pattern: {pattern!r}')
+    parts = []
+    for p in pattern.split('/') :
+      if p in ('', '.') or (p == '**' and parts and parts[-1] == '**') :
+        continue
+      if p == '..' :
+        raise ValueError(f'Unacceptable pattern: {pattern!r}')
+      parts.append(p)
+    if not parts :
+      raise ValueError(f'Unacceptable pattern: {pattern!r}')
+    self.pattern = pattern
+    self.dir_only = parts[-1] == '**'
+    self.recursive = '**' in parts
+    fixed = parts[:parts.index('**')] if self.recursive else parts
+    self.fixed = [ re.compile(_translate_segment(p)) for p in fixed ]
+    self.regex = _translate(parts)
+
+  def may_contain(self, parts, symlink=False) -> bool:
+    """
+    Whether the directory of relative path parts can contain a match.
+    Symbolic links to directories are only followed by the segments before the first '**'.
+    """
+    n = len(parts)
+    fixed = self.fixed
+    if n > len(fixed) - (not self.recursive) :
+      if symlink or not self.recursive :
+        return False
+      n = len(fixed)
+    return all( fixed[i].fullmatch(parts[i]) for i in range(n) )
+
+def _translate_segment(seg:str) -> str:
+  res = []
+  i, n = 0, len(seg)
+  while i < n :
+    c = seg[i]
+    i += 1
+    if c == '*' :
+      res.append('[^/]*')
+    elif c == '?' :
+      res.append('[^/]')
+    elif c == '[' :
+      j = i
+      if j < n and seg[j] == '!' :
+        j += 1
+      if j < n and seg[j] == ']' :
+        j += 1
+      j = seg.find(']', j)
+      if j < 0 :
+        res.append('\\[')
+      else:
+        s = seg[i:j].replace('\\', '\\\\')
+        i = j + 1
+        if s[0] == '!' :
+          s = '^/' + s[1:]
+        elif s[0] == '^' :
+          s = '\\' + s
+        res.append(f'[{s}]')
+    else:
+      res.append(re.escape(c))
+  return ''.join(res)
+
+def _translate(parts) -> str:
+  res = ''
+  sep = ''
+  last = len(parts) - 1
+  for i, p in enumerate(parts) :
+    if p == '**' :
+      if i == last :
+        res += '(?:/[^/]+)*' if res else '(?:[^/]+(?:/[^/]+)*)?'
+      else:
+        res += sep + '(?:[^/]+/)*'
+        sep = ''
+      continue
+    res += sep + _translate_segment(p)
+    sep = '/'
+  return res
+
+def _mtime(path):
+  try:
+    return os.stat(path).st_mtime_ns
+  except OSError :
+    return None
+
+def dirs_unchanged(root, visited:dict) -> bool:
+  """
+  True if none of the directories recorded in Walker.visited was modified since, i.e. the same walk would give the same matches.
+  """
+  root = os.fspath(root)
+  return all( _mtime(os.path.join(root, d)) == m for d, m in visited.items() )
+
+def _compile_any(patterns) :
+  if not patterns :
+    return None
+  return re.compile('|'.join( f'(?:{p.regex})' for p in patterns )).fullmatch
+
+def filter_paths(paths, patterns, exclude=()):
+  """
+  Generate the paths (relative, '/'-separated) of files matching one of the patterns, and not excluded : with the Walker semantic,
+  a path is excluded if it or one of its parent directories matches an exclude pattern.
+  """
+  match = _compile_any([ p for p in map(_Pattern, patterns) if not p.dir_only ])
+  excluded = _compile_any([ _Pattern(p) for p in exclude ])
+  if match is None :
+    return
+  if excluded is None :
+    yield from filter(match, paths)
+    return
+  dirs = {} # directory -> excluded
+  def dir_excluded(d):
+    res = dirs.get(d)
+    if res is None :
+      parent = d.rpartition('/')[0]
+      res = dirs[d] = bool(excluded(d)) or (bool(parent) and dir_excluded(parent))
+    return res
+  for p in paths :
+    if match(p) and not excluded(p) :
+      d = p.rpartition('/')[0]
+      if not d or not dir_excluded(d) :
+        yield p
+
+class Walker(object):
+  """
+  Match a set of glob patterns against the tree of root in a single scandir traversal.
+
+  The patterns are relative and '/'-separated, with the syntax of Path.glob : '*', '?' and '[...]' match inside a name,
+  '**' matches any number of directories (and only directories when it ends the pattern).
+  The matches are relative '/'-separated str, in a deterministic order : the matches of a directory, sorted by name, then the ones of its subdirectories.
+
+  A directory is entered only if a pattern may match below it. Directories matching an exclude pattern, named as one of prune_names
+  or whose path is in prune_paths are skipped with their content. With threads > 1, the subdirectories of root are walked concurrently.
+  The directories listed are recorded in visited, with their mtime read before listing them (see dirs_unchanged).
+  """
+  default_prune_names = frozenset(('.git', '.hg', '.svn'))
+
+  def __init__(self, root, patterns, exclude=(), prune_paths=(), prune_names=None, threads=None):
+    self.root = os.fspath(root)
+    self.patterns = [ _Pattern(p) for p in patterns ]
+    self.exclude = [ _Pattern(p) for p in exclude ]
+    self.prune_paths = { os.path.abspath(p) for p in prune_paths }
+    self.prune_names = self.default_prune_names if prune_names is None else frozenset(prune_names)
+    self.threads = threads
+    self.visited = {} # relative path -> st_mtime_ns
+    self._match_file = _compile_any([ p for p in self.patterns if not p.dir_only ])
+    self._match_dir = _compile_any(self.patterns)
+    self._excluded = _compile_any(self.exclude)
+
+  def _pruned(self, path, name) -> bool:
+    return name in self.prune_names or (bool(self.prune_paths) and os.path.abspath(path) in self.prune_paths)
+
+  def _scan(self, path, parts, out:list, visited:dict) -> list:
+    """
+    List the directory path, of relative path parts, append its matches to out and return the subdirectories to enter
+    """
+    visited['/'.join(parts)] = _mtime(path)
+    try:
+      with os.scandir(path) as it :
+        entries = sorted(it, key=lambda e: e.name)
+    except OSError :
+      return []
+    prefix = ''.join( p + '/' for p in parts )
+    match_file, match_dir, excluded = self._match_file, self._match_dir, self._excluded
+    subdirs = []
+    for e in entries :
+      rel = prefix + e.name
+      if excluded and excluded(rel) :
+        continue
+      try:
+        is_dir = e.is_dir()
+      except OSError :
+        is_dir = False
+      if is_dir :
+        if self._pruned(e.path, e.name) :
+          continue
+        if match_dir(rel) :
+          out.append(rel)
+        sub = parts + (e.name,)
+        symlink = e.is_symlink()
+        if any( p.may_contain(sub, symlink) for p in self.patterns ) :
+          subdirs.append((e.path, sub))
+      elif match_file and match_file(rel) :
+        out.append(rel)
+    return subdirs
+
+  def _walk(self, path, parts, out:list, visited:dict):
+    stack = [(path, parts)]
+    while stack :
+      path, parts = stack.pop()
+      stack.extend(reversed(self._scan(path, parts, out, visited)))
+
+  def _walk_collect(self, item):
+    out, visited = [], {}
+    self._walk(*item, out, visited)
+    return out, visited
+
+  def walk(self):
+    """
+    Generate the matches. See the class description.
+    """
+    if not self.patterns :
+      return
+    out = []
+    if self._match_dir('') and not self._pruned(self.root, '') :
+      out.append('')
+    subdirs = self._scan(self.root, (), out, self.visited)
+    yield from out
+    if self.threads and self.threads > 1 and len(subdirs) > 1 :
+      with ThreadPoolExecutor(self.threads) as ex :
+        for out, visited in ex.map(self._walk_collect, subdirs) :
+          self.visited.update(visited)
+          yield from out
+    else:
+      for path, parts in subdirs :
+        out = []
+        self._walk(path, parts, out, self.visited)
+        yield from out
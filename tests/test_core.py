@@ -1,3 +1,5 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from labs.core import *
 import pytest
@@ -224,6 +226,70 @@ class TestFileSet:
     assert isinstance(fs.conf, Dict)
     assert {'tt':1337, 'ttt':42, 'tttt':19} == fs.conf
 
+  def test_conf_copy_on_write(self):
+    fs = FileSet('/etc/f1.c', '/etc/f1.h', conf={'ttt':42, 'install':{'dest':'DATA'}})
+    d = fs.split_types()
+    d['c'].conf.install.dest = 'BIN'
+    d['h'].conf.ttt = 43
+    fs.conf.install.mode = 0o644
+    assert {'ttt':42, 'install':{'dest':'BIN'}} == d['c'].conf
+    assert {'ttt':43, 'install':{'dest':'DATA'}} == d['h'].conf
+    assert {'ttt':42, 'install':{'dest':'DATA', 'mode':0o644}} == fs.conf
+    for i in range(100) :
+      fs.filter(lambda p:True)
+    assert d['c'].conf._base is d['h'].conf._base
+    assert fs.conf._base._base is d['c'].conf._base
+    del d['c'].conf.ttt
+    assert {'install':{'dest':'BIN'}} == d['c'].conf
+    assert 42 == fs.conf.ttt
+
+  def test_path_normalization(self):
+    for cwd in (Path(), Path('/'), Path('/etc'), Path('rel/dir')) :
+      for a in ('t1', 'a/t1', '/abs/t1', './t1', 'a/./t1', 'a//t1', 'a/t1/', 'a/.', '.', '//t1', '../t1', 'a/../t1', Path('a/t1'), Path('/abs')) :
+        assert [cwd / a] == FileSet(a, cwd=cwd).list
+
+  def test_materialization(self):
+    fs = FileSet('/etc/t1', '/etc/t2')
+    l = fs.list
+    assert l is fs.list
+    assert fs.paths is fs.set
+    fs |= '/etc/t3'
+    assert pl('/etc/t1', '/etc/t2', '/etc/t3') == fs.list
+    assert set(pl('/etc/t1', '/etc/t2', '/etc/t3')) == fs.paths
+    fs.list = pl('/etc/t2')
+    assert '/etc/t2' in fs and '/etc/t1' not in fs
+    assert '/etc/t2' == fs.toNinja()
+
+  def test_set_operators(self):
+    fs1 = FileSet('/etc/t3', '/etc/t1', '/etc/t2', conf={'a':1, 'n':{'x':1}})
+    fs2 = FileSet('/etc/t4', '/etc/t2', '/etc/t3', conf={'b':2, 'n':{'y':2}})
+    self.assertSame(fs1 & fs2, ['/etc/t3', '/etc/t2'], conf={'a':1, 'b':2, 'n':{'x':1, 'y':2}})
+    self.assertSame(fs1 - fs2, ['/etc/t1'], conf={'a':1, 'n':{'x':1}})
+    self.assertSame(fs1 ^ fs2, ['/etc/t1', '/etc/t4'], conf={'a':1, 'b':2, 'n':{'x':1, 'y':2}})
+    self.assertSame(fs1, ['/etc/t3', '/etc/t1', '/etc/t2'], conf={'a':1, 'n':{'x':1}})
+    self.assertSame(fs2, ['/etc/t4', '/etc/t2', '/etc/t3'], conf={'b':2, 'n':{'y':2}})
+    self.assertSame(fs1 - '/etc/t1', ['/etc/t3', '/etc/t2'])
+    self.assertSame(fs1 & ['/etc/t2', '/etc/t3'], ['/etc/t3', '/etc/t2'])
+    self.assertSame(['/etc/t2', '/etc/t5', '/etc/t3'] - fs1, ['/etc/t5'], conf={})
+    self.assertSame(['/etc/t2', '/etc/t5', '/etc/t3'] & fs1, ['/etc/t2', '/etc/t3'], conf={'a':1, 'n':{'x':1}})
+    self.assertSame(['/etc/t5', '/etc/t3'] ^ fs1, ['/etc/t5', '/etc/t1', '/etc/t2'])
+    fs = FileSet('t1', 't2', 't3', cwd=Path('/etc'))
+    fs -= 't2'
+    self.assertSame(fs, ['/etc/t1', '/etc/t3'])
+    assert '/etc/t1 /etc/t3' == fs.toNinja()
+    fs &= FileSet('/etc/t3')
+    self.assertSame(fs, ['/etc/t3'])
+    fs ^= ['/etc/t3', '/etc/t4']
+    self.assertSame(fs, ['/etc/t4'])
+    with pytest.raises(TypeError) :
+      fs & ninja.Target('/etc/t4')
+
+  def test_set_operators_iterator(self):
+    fs = FileSet('/etc/t1', '/etc/t2', '/etc/t3')
+    self.assertSame(fs - ( p for p in ['/etc/t1'] ), ['/etc/t2', '/etc/t3'])
+    self.assertSame(fs & iter(['/etc/t1', '/etc/t3']), ['/etc/t1', '/etc/t3'])
+    self.assertSame(fs ^ iter(['/etc/t1', '/etc/t4']), ['/etc/t2', '/etc/t3', '/etc/t4'])
+
   def test___contains__(self):
     fs = FileSet()
     assert '/etc/t1' not in fs
@@ -334,3 +400,84 @@ class TestFileSet:
 
     
     
+
+class TestLazyFileSet:
+  def test_lazy(self):
+    calls = []
+    def source():
+      calls.append(1)
+      return ['a.c', 'b.h', 'a.c']
+    fs = LazyFileSet(source, conf={'x':1}, cwd=Path('src'))
+    assert [] == calls and not fs.is_materialized
+    assert 2 == len(fs)
+    assert ['src/a.c', 'src/b.h'] == list(fs.str_sorted())
+    assert 1 == fs.conf.x
+    fs |= 'c.c'
+    assert pl('src/a.c', 'src/b.h', 'src/c.c') == FileSet(fs).list
+    assert 1 == len(calls)
+
+  def test_iter_chunks(self):
+    fs = LazyFileSet(lambda : ( f'f{i}.c' for i in range(10) ), conf={'x':1}, chunk_size=4)
+    chunks = list(fs.iter_chunks())
+    assert [4, 4, 2] == list(map(len, chunks))
+    assert 1 == chunks[2].conf.x
+    assert not fs.is_materialized
+    assert [ f'f{i}.c' for i in range(10) ] == [ s for c in chunks for s in c.str_sorted() ]
+
+  def test_one_shot(self):
+    fs = LazyFileSet(iter(['a.c', 'b.c']))
+    assert 2 == sum(map(len, fs.iter_chunks()))
+    with pytest.raises(RuntimeError) :
+      len(fs)
+    fs = LazyFileSet(iter(['a.c', 'b.c']))
+    assert 2 == len(fs)
+    assert 2 == sum(map(len, fs.iter_chunks(1)))
+
+  def test_threads(self):
+    calls = []
+    def source():
+      calls.append(1)
+      time.sleep(0.01)
+      return ( f'f{i}.c' for i in range(1000) )
+    fs = LazyFileSet(source)
+    with ThreadPoolExecutor(8) as ex :
+      assert [1000] * 8 == list(ex.map(lambda _: len(fs), range(8)))
+    assert [1] == calls
+
+
+class TestFileType:
+  def test_get(self):
+    assert FileType.get('/etc/f1.c') is FileType.c
+    assert FileType.get('/etc/f1.cpp') is FileType.cpp
+    assert FileType.get(Path('/etc/f1.cxx')) is FileType.cpp
+    assert FileType.get('/etc/f1.hpp') is FileType.hpp
+    assert FileType.get('/etc/.c') is FileType.c
+    with pytest.raises(FileTypeNotFound) :
+      FileType.get('/etc/unknown')
+    with pytest.raises(FileTypeNotFound) :
+      FileType.get('/etc/unknown.xyz')
+    with pytest.raises(FileTypeNotFound) :
+      FileType.get('/etc/f1.c/unknown')
+
+  def test_get_longest_suffix(self):
+    assert FileType.get('/etc/foo.cpp.d') is FileType.get('foo.h.d')
+    assert 'hdeps' == FileType.get('/etc/foo.cpp.d').name
+    assert 'd' == FileType.get('/etc/foo.d').name
+    assert 'd' == FileType.get('/etc/foo.unknown.d').name
+    assert 'cpp' == FileType.get('/etc/a.b.c.cpp').name
+    assert 'hdeps' == FileType.get('/etc/a.b.c.cpp.d').name
+
+  def test_classify(self):
+    assert {} == FileType.classify([])
+    res = FileType.classify(['f1.c', 'f1.h', 'f2.c', 'dep.cpp.d', 'unknown', 'f3.o'])
+    assert ['c', 'h', 'hdeps', '_', 'o'] == list(res.keys())
+    assert {
+      'c' : ['f1.c', 'f2.c'],
+      'h' : ['f1.h'],
+      'hdeps' : ['dep.cpp.d'],
+      '_' : ['unknown'],
+      'o' : ['f3.o'],
+    } == res
+    res = FileType.classify(['unknown'], unknown=None)
+    assert {None : ['unknown']} == res
+
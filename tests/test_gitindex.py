@@ -0,0 +1,71 @@
+import os
+import shutil
+import subprocess
+import pytest
+from labs.gitindex import find_repository, read_index, GitIndexError
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason='git not found')
+
+
+def git(cwd, *args):
+  subprocess.run(['git', '-c', 'init.defaultBranch=main', *args], cwd=cwd, check=True, capture_output=True)
+
+@pytest.fixture
+def repo(tmp_path):
+  files = ['a.c', 'lib/x.c', 'lib/x.h', 'lib/sub/' + 'long_' * 30 + '.c', 'z.txt']
+  for f in files :
+    p = tmp_path / f
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text('')
+  (tmp_path / 'untracked.c').write_text('')
+  git(tmp_path, 'init', '-q')
+  git(tmp_path, 'add', *files)
+  return tmp_path, sorted(files)
+
+
+class TestGitIndex:
+  def test_find_repository(self, repo):
+    root, files = repo
+    index = str(root / '.git' / 'index')
+    assert (str(root), index) == find_repository(root)
+    assert (str(root), index) == find_repository(root / 'lib' / 'sub')
+  
+  @pytest.mark.parametrize('version', [2, 3, 4])
+  def test_versions(self, repo, version):
+    root, files = repo
+    git(root, 'update-index', '--index-version', str(version))
+    if version == 3 :
+      # Intent-to-add entries have extended flags
+      git(root, 'add', '-N', 'untracked.c')
+      files = sorted(files + ['untracked.c'])
+    assert files == read_index(root / '.git' / 'index')
+
+  def test_skip_worktree(self, repo):
+    root, files = repo
+    git(root, 'update-index', '--skip-worktree', 'z.txt')
+    assert [ f for f in files if f != 'z.txt' ] == read_index(root / '.git' / 'index')
+
+  def test_invalid(self, tmp_path):
+    p = tmp_path / 'index'
+    p.write_bytes(b'DIRC\0\0\0\x09\0\0\0\0')
+    with pytest.raises(GitIndexError) :
+      read_index(p)
+    p.write_bytes(b'DIRC\0\0\0\x02\0\0\0\x05')
+    with pytest.raises(GitIndexError) :
+      read_index(p)
+
+  def test_linked_worktree_sha256(self, tmp_path):
+    # The object format is in the config of the main git dir, not in the git dir of the linked work tree
+    main = tmp_path / 'main'
+    main.mkdir()
+    (main / 'a.c').write_text('')
+    try:
+      git(main, 'init', '-q', '--object-format=sha256')
+    except subprocess.CalledProcessError :
+      pytest.skip('sha256 repositories not supported by git')
+    git(main, 'add', 'a.c')
+    git(main, '-c', 'user.name=labs', '-c', 'user.email=labs@localhost', 'commit', '-q', '-m', 'a')
+    git(main, 'worktree', 'add', '-q', str(tmp_path / 'linked'))
+    root, index = find_repository(tmp_path / 'linked')
+    assert str(tmp_path / 'linked') == root
+    assert ['a.c'] == read_index(index)
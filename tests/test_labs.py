@@ -1,4 +1,5 @@
 import os
+import shutil
 import pytest
 import filecmp
 import pytest_datadir_ng
@@ -7,7 +8,7 @@ from pathlib import Path
 from unittest.mock import Mock
 
 def assertDirsEqual(d1, d2):
-  cmp = filecmp.dircmp(d1, d2)
+  cmp = filecmp.dircmp(d1, d2, ignore=filecmp.DEFAULT_IGNORES + [Labs.state_dirname])
   assert cmp.right_only == []
   assert cmp.left_only == []
   assert cmp.diff_files == []
@@ -20,6 +21,7 @@ def assertFilesEqual(f1, f2):
 def mock_shutil(monkeypatch):
   mock_which = Mock(side_effect=lambda x:f'/bin/{x}')
   monkeypatch.setattr('shutil.which', mock_which)
+  monkeypatch.setattr('labs.utils.which', mock_which)
   
 @pytest.fixture
 def check_labs(datadir_copy, datadir):
@@ -49,3 +51,136 @@ def test_ext(check_labs, mock_shutil):
   
 def test_install(check_labs, mock_shutil):
   check_labs()
+
+def test_reconfigure_keeps_mtime(tmp_path, mock_shutil):
+  src = tmp_path / 'src'
+  src.mkdir()
+  (src / 'labs_build.py').write_text("Rule('concat', command='cat '+v_in+' > '+v_out).build() >> (build_dir/'out')\n")
+  build = tmp_path / 'build'
+  Labs(src, build, {}).process()
+  outputs = [ build / Labs.default_ninja_build_filename, build / Labs.default_cache_filename ]
+  for p in outputs :
+    os.utime(p, ns=(1000000000, 1000000000))
+  Labs(src, build, {}).process()
+  for p in outputs :
+    assert 1000000000 == p.stat().st_mtime_ns
+  Labs(src, build, {'OPT':'1'}).process()
+  assert 1000000000 == outputs[0].stat().st_mtime_ns
+  assert 1000000000 != outputs[1].stat().st_mtime_ns
+
+def test_noop_reconfigure(tmp_path, mock_shutil):
+  src = tmp_path / 'src'
+  src.mkdir()
+  labs_file = src / 'labs_build.py'
+  labs_file.write_text("open(build_dir/'runs', 'a').write('x')\n")
+  build = tmp_path / 'build'
+  runs = build / 'runs'
+  Labs(src, build, {}).process()
+  assert 'x' == runs.read_text()
+  Labs(src, build, {}).process()
+  Labs(None, build).process()
+  assert 'x' == runs.read_text()
+  Labs(src, build, {}, use_cache=False).process()
+  assert 'xx' == runs.read_text()
+  Labs(src, build, {'OPT':'1'}).process()
+  assert 'xxx' == runs.read_text()
+  labs_file.write_text("open(build_dir/'runs', 'a').write('y')\n")
+  Labs(src, build, {'OPT':'1'}).process()
+  assert 'xxxy' == runs.read_text()
+  (build / Labs.default_ninja_build_filename).unlink()
+  Labs(src, build, {'OPT':'1'}).process()
+  assert 'xxxyy' == runs.read_text()
+
+def test_programs_persisted(tmp_path, mock_shutil, monkeypatch):
+  import labs.utils
+  src = tmp_path / 'src'
+  src.mkdir()
+  (src / 'labs_build.py').write_text("(Rule('r', command='prog '+v_out) << find_program('prog')).build() >> (build_dir/'out')\n")
+  build = tmp_path / 'build'
+  Labs(src, build, {}).process()
+  monkeypatch.setattr('labs.utils.which', Mock(side_effect=lambda x:f'/other/{x}'))
+  Labs(src, build, {'OPT':'1'}).process()
+  assert '/bin/prog' in (build / Labs.default_ninja_build_filename).read_text()
+  labs.utils.which.assert_not_called()
+  monkeypatch.setenv('PATH', str(tmp_path))
+  Labs(src, build, {'OPT':'2'}).process()
+  assert '/other/prog' in (build / Labs.default_ninja_build_filename).read_text()
+
+def test_exec_memoized(tmp_path, mock_shutil, monkeypatch):
+  from subprocess import CompletedProcess
+  m_run = Mock(return_value=CompletedProcess(['prog'], 0, 'out', ''))
+  monkeypatch.setattr('subprocess.run', m_run)
+  monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+  src = tmp_path / 'src'
+  src.mkdir()
+  (src / 'labs_build.py').write_text("assert (0, 'out', '') == find_program('prog').exec('--version')\n")
+  build = tmp_path / 'build'
+  config = {Labs.memoize_exec_key:'1', Labs.shared_exec_cache_key:'1'}
+  Labs(src, build, config).process()
+  Labs(src, build, {**config, 'OPT':'1'}).process()
+  assert 1 == m_run.call_count
+  Labs(src, tmp_path / 'build2', config).process()
+  assert 1 == m_run.call_count
+  Labs(src, tmp_path / 'build3', {Labs.memoize_exec_key:'1'}).process()
+  assert 2 == m_run.call_count
+
+def test_glob_cached(tmp_path, mock_shutil, monkeypatch):
+  src = tmp_path / 'src'
+  (src / 'sub').mkdir(parents=True)
+  (src / 'sub' / 'a.c').write_text('')
+  labs_file = src / 'labs_build.py'
+  labs_file.write_text("open(build_dir/'files', 'w').write(' '.join(glob('**/*.c').str_sorted()))\n")
+  build = tmp_path / 'build'
+  files = build / 'files'
+  Labs(src, build, {}).process()
+  assert str(src / 'sub' / 'a.c') == files.read_text()
+  scandir = os.scandir
+  calls = []
+  monkeypatch.setattr('os.scandir', lambda d: calls.append(d) or scandir(d))
+  Labs(src, build, {'OPT':'1'}).process()
+  assert [] == calls
+  assert str(src / 'sub' / 'a.c') == files.read_text()
+  (src / 'sub' / 'b.c').write_text('')
+  Labs(src, build, {'OPT':'1'}).process()
+  assert 0 < len(calls)
+  assert f"{src / 'sub' / 'a.c'} {src / 'sub' / 'b.c'}" == files.read_text()
+
+def test_git_files(tmp_path, request):
+  import subprocess
+  # Look for git before shutil.which is mocked
+  has_git = shutil.which('git') is not None
+  request.getfixturevalue('mock_shutil')
+  src = tmp_path / 'src'
+  (src / 'sub').mkdir(parents=True)
+  for f in ('a.c', 'sub/b.c', 'sub/c.h') :
+    (src / f).write_text('')
+  (src / 'labs_build.py').write_text("open(build_dir/'files', 'w').write(' '.join(git_files('**/*.c', exclude=['a.c']).str_sorted()))\n")
+  build = src / 'build'
+  files = build / 'files'
+  Labs(src, build, {}).process()
+  assert str(src / 'sub' / 'b.c') == files.read_text()
+  if not has_git :
+    pytest.skip('git not found')
+  subprocess.run(['git', 'init', '-q'], cwd=tmp_path, check=True)
+  subprocess.run(['git', 'add', 'src/sub/c.h', 'src/a.c'], cwd=tmp_path, check=True)
+  (build / 'x.c').write_text('')
+  subprocess.run(['git', 'add', '-f', 'src/build/x.c'], cwd=tmp_path, check=True)
+  Labs(src, build, {'OPT':'1'}).process()
+  assert '' == files.read_text()
+  subprocess.run(['git', 'add', 'src/sub/b.c'], cwd=tmp_path, check=True)
+  Labs(src, build, {'OPT':'1'}).process()
+  assert str(src / 'sub' / 'b.c') == files.read_text()
+
+def test_glob_lazy(tmp_path, mock_shutil):
+  src = tmp_path / 'src'
+  (src / 'sub').mkdir(parents=True)
+  (src / 'sub' / 'a.c').write_text('')
+  (src / 'labs_build.py').write_text(
+    "fs = glob('**/*.c', lazy=True)\n"
+    "assert not fs.is_materialized\n"
+    "open(build_dir/'files', 'w').write(' '.join(fs.str_sorted()))\n"
+  )
+  build = tmp_path / 'build'
+  Labs(src, build, {}).process()
+  assert str(src / 'sub' / 'a.c') == (build / 'files').read_text()
+  assert str(src / 'sub') in (build / 'build.ninja.d').read_text()
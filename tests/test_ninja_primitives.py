@@ -41,10 +41,30 @@ class TestTarget:
     t2 = Target('/etc/t2', '/etc/t3')
     assert 3 == len(t1 | t2)
 
+  def test_toNinja(self):
+    t = Target('/etc/t 2', Path('/etc/t1'))
+    assert '/etc/t$ 2 /etc/t1' == t.toNinja()
+    t |= '/etc/t0'
+    assert '/etc/t$ 2 /etc/t0 /etc/t1' == t.toNinja()
+    t -= '/etc/t1'
+    assert '/etc/t$ 2 /etc/t0' == t.toNinja()
+    e = Expr('/etc/t3')
+    t = Target(e)
+    assert '/etc/t3' == t.toNinja()
+    e += 'x'
+    assert '/etc/t3x' == str(e)
+    assert '/etc/t3' == t.toNinja() and Expr('/etc/t3') in t
+
 
 class TestVariableAndExpr:
   def test_escape(self):
     assert 'This$ is$ an$:$\n...escaped$ str$ $${var}' == escape('This is an:\n...escaped str ${var}')
+    assert 'nothing_to_escape' == escape('nothing_to_escape')
+
+  def test_escape_join(self):
+    assert '' == escape_join([])
+    assert 'a b$ c $$d' == escape_join(['a', 'b c', '$d'])
+    assert 'a\n  b$:c' == escape_join(['a', 'b:c'], sep='\n  ')
 
   def test_variable_str(self):
     assert '${var}' == str(Variable('var', 'value'))
@@ -72,6 +92,35 @@ class TestVariableAndExpr:
     assert '${this}$ is$ an$ addition' == str(Variable('this', 'value') + Expr(' is an addition'))
     assert '${this}$ is$ ${an}${addition}' == str(Variable('this', 'value') +(Expr(' is ') + Variable('an', 'value') ) + Expr(Variable('addition', 'value')))
 
+  def test_Expr_iadd_does_not_alter_copies(self):
+    e1 = Expr('a')
+    e2 = Expr(e1)
+    e3 = e1 + 'b'
+    e1 += 'c'
+    assert 'ac' == str(e1)
+    assert 'a' == str(e2)
+    assert 'ab' == str(e3)
+    assert ('a', 'c') == e1.value
+    e4 = e1
+    e1 += 'd'
+    assert 'acd' == str(e1) and 'ac' == str(e4)
+
+  def test_Expr_value(self):
+    var = Variable('var', 'value')
+    e = Expr('a')
+    for i in range(100) :
+      e += var
+    assert ('a', *[var]*100) == e.value
+    e.value = ['b', var]
+    assert 'b${var}' == str(e)
+    assert hash(Expr('b${var}')) != hash(e)
+    assert Expr('b') + var == e
+
+  def test_quote_arg_list_long(self):
+    args = [ f'arg {i}' for i in range(10000) ]
+    e = quote_arg_list('cmd', *args)
+    assert str(e) == escape(' '.join(('cmd', *( f"'arg {i}'" for i in range(10000) ))))
+
 
 class TestRule:
   def test_simple(self):
@@ -122,3 +171,32 @@ class TestBuild:
     b = order_only('in_oo1') >> implicit('in_imp1') >> explicit("in1") >> r.build(imp_out='out_imp1') >> Target('out1') >> implicit('out_imp1')
     assert res == b.toNinja().strip()
     
+
+  def test_build_each(self):
+    r = Rule('cc', command='cc '+v_in+' -o '+v_out)
+    builds = r.build_each(['src/a b.c', Path('src/sub/c.c'), 'd', '/e.c'], '{dir}/{stem}.o', flags='-O2')
+    assert [
+      'build src/a$ b.o : cc src/a$ b.c\n  flags = -O2',
+      'build src/sub/c.o : cc src/sub/c.c\n  flags = -O2',
+      'build d.o : cc d\n  flags = -O2',
+      'build /e.o : cc /e.c\n  flags = -O2',
+    ] == [ b.toNinja() for b in builds ]
+    implicit('dep.h') >> builds[0]
+    assert 'build src/a$ b.o : cc src/a$ b.c | dep.h\n  flags = -O2' == builds[0].toNinja()
+    assert 'build src/sub/c.o : cc src/sub/c.c\n  flags = -O2' == builds[1].toNinja()
+    builds = r.build_each(Target('x.c', 'w.c'), lambda p: p + '.o')
+    assert ['build w.c.o : cc w.c', 'build x.c.o : cc x.c'] == [ b.toNinja() for b in builds ]
+    builds = r.build_each(['src/a.b.c', 'd'], 'out/{base}.o')
+    assert ['build out/src/a.b.o : cc src/a.b.c', 'build out/d.o : cc d'] == [ b.toNinja() for b in builds ]
+    builds = r.build_each(['d.c'], '{dir}/obj/{name}.o')
+    assert ['build obj/d.c.o : cc d.c'] == [ b.toNinja() for b in builds ]
+    v = Variable('src', '/s')
+    builds = r.build_each(Target('a b.c', 'x$:y.c', Path('p q.c'), Expr(v) + '/v w.c'), '{base}.o')
+    assert [
+      'build ${src}/v$ w.o : cc ${src}/v$ w.c',
+      'build a$ b.o : cc a$ b.c',
+      'build p$ q.o : cc p$ q.c',
+      'build x$$$:y.o : cc x$$$:y.c',
+    ] == [ b.toNinja() for b in builds ]
+    assert builds[1].toNinja() == ('a b.c' >> r.build() >> 'a b.o').toNinja()
+    assert isinstance(builds[0].explicit.o.paths.pop().value[0], Variable)
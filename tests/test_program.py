@@ -227,3 +227,40 @@ class TestProgram:
     assert 'echo6' == r.name
 
     
+
+  def test_exec_memoize(self, mock_subprocess, prog):
+    m_run, m_popen, r_run, r_popen = mock_subprocess
+    r = prog.exec('test', memoize=True)
+    assert r == (r_run.returncode, r_run.stdout, r_run.stderr)
+    r = prog.exec(('test',), memoize=True)
+    assert r == (r_run.returncode, r_run.stdout, r_run.stderr)
+    assert 1 == m_run.call_count
+    prog.exec('test')
+    prog.exec('test2', memoize=True)
+    prog.exec('test', input='in', memoize=True)
+    prog.exec('test', input='in', memoize=True)
+    prog.exec('test', input=StringIO('in'), memoize=True)
+    prog.exec('test', memoize=True, env_deps=('LABS_TEST_VAR',), env={'LABS_TEST_VAR':'1'})
+    prog.exec('test', memoize=True, env_deps=('LABS_TEST_VAR',), env={'LABS_TEST_VAR':'2'})
+    assert 7 == m_run.call_count
+
+  def test_exec_memoize_bytes(self, mock_subprocess, project, prog):
+    m_run, m_popen, r_run, r_popen = mock_subprocess
+    m_run.return_value = CompletedProcess(['echo'], 0, b'\xff\x00', None)
+    project.memoize_exec = True
+    assert (0, b'\xff\x00', None) == prog.exec(input=b'')
+    assert (0, b'\xff\x00', None) == prog.exec(input=b'')
+    assert 1 == m_run.call_count
+
+  def test_exec_async(self, mock_subprocess, project, prog):
+    import threading
+    m_run, m_popen, r_run, r_popen = mock_subprocess
+    barrier = threading.Barrier(4, timeout=10)
+    m_run.side_effect = lambda *args, **kwargs: barrier.wait() is not None and r_run
+    project.probe_jobs = 4
+    futures = [ prog.exec_async(f'test{i}') for i in range(4) ]
+    for f in futures :
+      assert f.result() == (r_run.returncode, r_run.stdout, r_run.stderr)
+    assert 4 == m_run.call_count
+    project.shutdown_executor()
+    assert project._executor is None
@@ -0,0 +1,312 @@
+from labs import *
+from pathlib import Path
+from io import StringIO
+from types import SimpleNamespace
+import random
+import threading
+import time
+import pytest
+
+
+@pytest.fixture
+def project():
+  return Project(Path('/test'), Path('/test'), Path('/test/build'))
+
+def ninja_str(project):
+  f = StringIO()
+  project.writeNinja(f)
+  return f.getvalue()
+
+
+class TestWriteNinja:
+  def test_iter_ninja(self, project):
+    r = project.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    for i in range(10) :
+      f'in{i}' >> r.build() >> f'out{i}'
+    res = ninja_str(project)
+    assert res == ''.join(project.iter_ninja())
+    assert 'rule cp\n  command = cp$ ${in}$ ${out}\n' in res
+    for i in range(10) :
+      assert f'build out{i} : cp in{i}\n' in res
+
+  def test_write_batches(self, project):
+    class Sink(object):
+      def __init__(self):
+        self.calls = []
+      def writelines(self, l):
+        self.calls.append(list(l))
+    r = project.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    for i in range(1000) :
+      f'in{i}' >> r.build() >> f'out{i}'
+    sink = Sink()
+    project.writeNinja(sink)
+    assert len(sink.calls) > 1
+    assert ''.join(''.join(c) for c in sink.calls) == ''.join(project.iter_ninja())
+
+  def test_build_each(self, project):
+    r = project.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    r << '/bin/cp'
+    for i in range(10) :
+      f'in{i}' >> r.build() >> f'out{i}'
+    expected = ninja_str(project)
+    p = Project(Path('/test'), Path('/test'), Path('/test/build'))
+    r = p.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    r << '/bin/cp'
+    builds = r.build_each(FileSet(*( f'in{i}' for i in range(10) )), lambda s: 'out' + s[2:])
+    assert builds == p.build_rules_flat
+    assert [builds[3]] == p.build_rules[ninja.Expr('out3')]
+    assert expected == ninja_str(p)
+
+  def test_merge_rules(self, project):
+    a = project.Rule('a', command='cp '+ninja.v_in+' '+ninja.v_out)
+    b = project.Rule('b', command='cp '+ninja.v_in+' '+ninja.v_out)
+    c = project.Rule('c', command='mv '+ninja.v_in+' '+ninja.v_out)
+    'i1' >> a.build() >> 'o1'
+    'i2' >> b.build() >> 'o2'
+    'i3' >> c.build() >> 'o3'
+    res = ninja_str(project)
+    assert 'rule a\n' in res and 'rule b\n' not in res and 'rule c\n' in res
+    assert 'build o2 : a i2\n' in res
+    assert 'build o3 : c i3\n' in res
+    assert ('b', 'a') in project.plan_rules()[0].items()
+    project.compact_manifest = False
+    assert 'rule b\n' in ninja_str(project)
+
+  def test_inline_variables(self, project):
+    r = project.Rule('cc', command='cc '+ninja.V('flags')+' '+ninja.V('opt')+' '+ninja.V('dep')+' '+ninja.v_in)
+    v = project.Variable('top', 'x')
+    for i in range(3) :
+      f'in{i}' >> r.build(flags='-O2 -g', opt=f'-{i}', dep=ninja.Expr('-I') + v, base='/usr', inc=ninja.Expr('-I') + r.base) >> f'out{i}'
+    res = ninja_str(project)
+    assert '  command = cc$ -O2$ -g$ ${opt}$ ${dep}$ ${in}\n' in res
+    assert 'flags =' not in res
+    assert res.count('  opt = ') == 3
+    assert res.count('  dep = -I${top}') == 3
+    assert res.count('  base = /usr') == 3
+
+  def test_inline_reserved_variables(self, project):
+    r = project.Rule('cc', command='cc '+ninja.v_in+' '+ninja.v_out)
+    pool = project.Pool('heavy', 2)
+    for i in range(3) :
+      f'in{i}' >> r.build(pool=pool, depfile='x.d', restat='1', deps='gcc') >> f'out{i}'
+    res = ninja_str(project)
+    assert 'rule cc\n  command = cc$ ${in}$ ${out}\n\n' in res
+    for k, v in (('pool', 'heavy'), ('depfile', 'x.d'), ('restat', '1'), ('deps', 'gcc')) :
+      assert res.count(f'\n  {k} = {v}\n') == 3
+
+  def test_factor_paths(self):
+    project = Project(Path('/s/labs_build.py'), Path('/s'), Path('/s/b u'))
+    r = project.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    ('/s/a', '/s/b/x', '/s/b u/y', '/sx', '/s') >> r.build() >> ('/s/b u/o', '/s/b u')
+    res = ninja_str(project)
+    assert '\nsrc_dir = /s\n' in res
+    assert "\nbuild . o : cp ${src_dir} ${src_dir}/a y ${src_dir}/b/x /sx\n" in res
+    project.factor_paths = False
+    res = ninja_str(project)
+    assert 'src_dir =' not in res
+    assert '\nbuild /s/b$ u /s/b$ u/o : cp /s /s/a /s/b$ u/y /s/b/x /sx\n' in res
+
+  def test_phony_stamps(self, project):
+    r = project.Rule('cc', command='cc '+ninja.v_in+' '+ninja.v_out)
+    r.add_implicit_dep(['/usr/bin/cc', '/usr/bin/as'])
+    for i in range(4) :
+      b = f'in{i}' >> r.build() >> f'out{i}'
+      ninja.order_only(['h1', 'h2', 'h3']) >> b
+    ninja.implicit('h4') >> b
+    res = ninja_str(project)
+    assert res == ninja_str(project)
+    assert not project.build_rules_flat[0].implicit.i
+    stamps = [ l.split()[1] for l in res.splitlines() if l.endswith(' : phony /usr/bin/as /usr/bin/cc') ]
+    assert 1 == len(stamps)
+    assert f'build out0 : cc in0 | {stamps[0]} || ' in res
+    assert 'build out3 : cc in3 | /usr/bin/as /usr/bin/cc h4 || ' in res
+    assert {'stamps' : 2, 'edges' : 3*2 + 3 + 4*3, 'edges_compacted' : 3+2 + 3 + 4+3} == project.manifest_stats
+    project.compact_manifest = False
+    res = ninja_str(project)
+    assert 'phony' not in res
+    assert 'build out0 : cc in0 | /usr/bin/as /usr/bin/cc || h1 h2 h3\n' in res
+
+  def test_pools(self, project):
+    link = project.Pool('link', 2)
+    assert link is project.Pool('link')
+    assert 1 <= project.Pool('install').depth
+    with pytest.raises(PoolNameConflictError) :
+      project.Pool('link', 3)
+    assert ninja.console is project.Pool('console')
+    for depth in (0, -1) :
+      with pytest.raises(ValueError) :
+        ninja.Pool('console', depth)
+      with pytest.raises(ValueError) :
+        project.Pool('zero', depth)
+    assert 1 == ninja.Pool('console', 4).depth
+    r = project.Rule('ld', command='ld '+ninja.v_in+' '+ninja.v_out, pool=link)
+    'a.o' >> r.build() >> 'a'
+    t = project.Rule('test', command='t '+ninja.v_in)
+    'a' >> t.build(pool=ninja.console) >> 'check'
+    'a' >> t.build(pool=ninja.Pool('heavy', 1)) >> 'check_heavy'
+    res = ninja_str(project)
+    assert 'pool link\n  depth = 2\n\npool install\n  depth = ' in res
+    assert '\npool heavy\n  depth = 1\n' in res
+    assert 'pool console' not in res
+    assert res.index('pool heavy') < res.index('rule ld\n  command = ld$ ${in}$ ${out}\n  pool = link\n')
+    assert 'build check : test a\n  pool = console\n' in res
+    assert res == ninja_str(project)
+    cc = project.Rule('cc', command='cc '+ninja.v_in+' '+ninja.v_out)
+    for i in range(3) :
+      f'{i}.c' >> cc.build(pool=link) >> f'{i}.o'
+    res = ninja_str(project)
+    for i in range(3) :
+      assert f'build {i}.o : cc {i}.c\n  pool = link\n' in res
+    t2 = project.Rule('t2', command='t2')
+    'a' >> t2.build(pool=ninja.Pool('link', 4)) >> 'b'
+    with pytest.raises(PoolNameConflictError) :
+      ninja_str(project)
+
+  def test_cache(self, project):
+    project.declare_option('OPT', STRING, 'val', 'An option')
+    f = StringIO()
+    project.writeCache(f)
+    assert f.getvalue() == ''.join(project.iter_cache())
+    assert '//An option (Default : val)\nOPT:STRING=val\n' in f.getvalue()
+
+
+class TestRegenerate:
+  def test_disabled(self, project):
+    assert project.regenerate_build() is None
+    assert 'labs_regenerate' not in ninja_str(project)
+
+  def test_regenerate(self, project):
+    project.regenerate_command = ['/bin/labs', '/test/labs_build.py', '-C', '/test/build']
+    res = ninja_str(project)
+    assert 'rule labs_regenerate\n  command = /bin/labs$ /test/labs_build.py$ -C$ /test/build\n' in res
+    assert '  depfile = build.ninja.d\n  generator = 1\n  restat = 1\n' in res
+    assert '\nbuild build.ninja : labs_regenerate ${src_dir}\n' in res
+    assert res == ninja_str(project)
+
+  def test_depfile(self, project):
+    project.add_configure_dep(Path('/test/labs_build.py'), '/test/a dir', '/test/$#')
+    project.add_configure_dep('/test/labs_build.py')
+    assert 'build.ninja: \\\n  /test/labs_build.py \\\n  /test/a\\ dir \\\n  /test/$$\\#\n' == ''.join(project.iter_depfile())
+
+
+class TNode(Node):
+  def __init__(self, project, name, log):
+    super().__init__(SimpleNamespace(project=project, getContext=lambda : {}))
+    self.name = name
+    self.log = log
+    self.rule = project.Rule(f'r_{name}', command='touch '+ninja.v_out)
+
+  def preprocess(self):
+    self.log.append(self.name)
+    self.project.Variable(f'v_{self.name}', self.name)
+
+  def process_target(self, t):
+    time.sleep(random.random() / 1000)
+    out = f'{self.name}_{t.toNinja()}'
+    t >> self.rule.build() >> out
+    return [ninja.Target(out)]
+
+
+class TestFreeze:
+  def test_dependency_order(self, project):
+    log = []
+    b = TNode(project, 'b', log)
+    a = TNode(project, 'a', log)
+    c = TNode(project, 'c', log)
+    c.add(ninja.Target('in'))
+    a.add(c)
+    project.freeze()
+    assert ['b', 'c', 'a'] == log
+    assert ['a_c_in'] == [ t.toNinja() for t in a.output ]
+
+  def test_cycle(self, project):
+    a = TNode(project, 'a', [])
+    b = TNode(project, 'b', [])
+    a.add(b)
+    b.add(a)
+    with pytest.raises(NodeCycleError) :
+      project.freeze()
+
+  def test_graph(self, project):
+    log = []
+    b = TNode(project, 'b', log)
+    a = TNode(project, 'a', log)
+    c = TNode(project, 'c', log)
+    c.add(ninja.Target('in'))
+    a.add(c)
+    r = project.Rule('cp', command='cp '+ninja.v_in+' '+ninja.v_out)
+    project.v_src + '/x' >> r.build() >> '/test/build/sub/../y'
+    ninja.implicit('y') >> r.build() >> project.v_build + '/z'
+    g = project.graph()
+    assert 1 == g['version']
+    assert [
+      { 'outputs' : ['y'], 'rule' : 'cp', 'node' : None, 'deps' : [] },
+      { 'outputs' : ['z'], 'rule' : 'cp', 'node' : None, 'deps' : [0] },
+      { 'outputs' : ['c_in'], 'rule' : 'r_c', 'node' : 'TNode#2', 'deps' : [] },
+      { 'outputs' : ['a_c_in'], 'rule' : 'r_a', 'node' : 'TNode#1', 'deps' : [2] },
+    ] == g['builds']
+
+  def test_concurrent_outputs(self, project):
+    # Both nodes must be processing at the same time : the outputs are not serialized by a lock shared by all the nodes
+    barrier = threading.Barrier(2, timeout=5)
+    def preprocess():
+      barrier.wait()
+    nodes = [ TNode(project, f'n{i}', []) for i in range(2) ]
+    for n in nodes :
+      n.add(ninja.Target('in'))
+      n.preprocess = preprocess
+    threads = [ threading.Thread(target=lambda n=n: n.output) for n in nodes ]
+    for t in threads :
+      t.start()
+    for t in threads :
+      t.join()
+    assert not barrier.broken
+    assert [['n0_in'], ['n1_in']] == [ [ t.toNinja() for t in n.output ] for n in nodes ]
+
+  def make_tree(self, jobs):
+    project = Project(Path('/test'), Path('/test'), Path('/test/build'))
+    project.jobs = jobs
+    log = []
+    nodes = []
+    for i in range(40) :
+      n = TNode(project, f'n{i}', log)
+      n.add(ninja.Target(f'in{i}'))
+      for j in range(i % 4) :
+        n.add(nodes[(i * 7 + j) % i])
+      nodes.append(n)
+    return project
+
+  def test_parallel_same_output(self):
+    expected = ninja_str(self.make_tree(1))
+    for i in range(3) :
+      assert expected == ninja_str(self.make_tree(8))
+
+
+class CNode(Node):
+  def __init__(self, project, streaming):
+    super().__init__(SimpleNamespace(project=project, getContext=lambda : {'FileSet' : FileSet}))
+    self.streaming = streaming
+    self.rule = project.Rule('cc', command='cc '+ninja.v_in+' '+ninja.v_out)
+    self.calls = []
+
+  def process_c(self, fs):
+    self.calls.append(len(fs))
+    for f in fs :
+      f >> self.rule.build() >> f'{f}.o'
+    return []
+
+
+class TestStreaming:
+  def test_streaming(self):
+    res = []
+    for streaming in (False, True) :
+      p = Project(Path('/test'), Path('/test'), Path('/test/build'))
+      n = CNode(p, streaming)
+      fs = LazyFileSet(lambda : ( f'f{i}.c' for i in range(10) ), cwd=Path('/src'), chunk_size=3)
+      n.add(fs)
+      p.freeze()
+      assert streaming != fs.is_materialized
+      res.append((n.calls, ninja_str(p)))
+    assert [10] == res[0][0]
+    assert [3, 3, 3, 1] == res[1][0]
+    assert res[0][1] == res[1][1]
@@ -0,0 +1,122 @@
+import json
+import pytest
+from click.testing import CliRunner
+from labs import Labs
+from labs.cli import main
+from labs.stats import LogEntry, NinjaLogError, read_ninja_log, latest_entries, analyze, format_text
+
+
+# a.o and b.o compile in parallel, then the link needs both, then the test runs
+GRAPH = { 'version' : 1, 'builds' : [
+  { 'outputs' : ['a.o'], 'rule' : 'cc', 'node' : 'Cc#0', 'deps' : [] },
+  { 'outputs' : ['b.o'], 'rule' : 'cc', 'node' : 'Cc#0', 'deps' : [] },
+  { 'outputs' : ['app', 'app.map'], 'rule' : 'ld', 'node' : 'Ld#0', 'deps' : [0, 1] },
+  { 'outputs' : ['gen.h'], 'rule' : 'gen', 'node' : None, 'deps' : [] },
+  { 'outputs' : ['check'], 'rule' : 'test', 'node' : None, 'deps' : [2] },
+]}
+
+LOG = '''# ninja log v5
+0\t900\t0\ta.o\t1
+0\t950\t0\told\t1
+0\t100\t0\ta.o\t1
+0\t300\t0\tb.o\t2
+300\t1000\t0\tapp\t3
+300\t1000\t0\tapp.map\t3
+1000\t1020\t0\tbuild.ninja\t5
+1000\t1100\t0\tcheck\t4
+'''
+
+def entries():
+  return [ LogEntry(*map(int, l.split('\t')[:2]), l.split('\t')[3]) for l in LOG.splitlines()[3:] ]
+
+
+class TestNinjaLog:
+  def test_runs(self, tmp_path):
+    p = tmp_path / '.ninja_log'
+    p.write_text(LOG)
+    runs = read_ninja_log(p)
+    assert [['a.o', 'old'], ['a.o', 'b.o', 'app', 'app.map', 'build.ninja', 'check']] == [ [ e.output for e in r ] for r in runs ]
+    assert entries() == runs[-1]
+    # A run of other outputs, its start times reset
+    p.write_text(LOG + '0\t50\t0\tgen.h\t6\n')
+    runs = read_ninja_log(p)
+    assert 3 == len(runs) and [LogEntry(0, 50, 'gen.h')] == runs[-1]
+    assert ['old', 'a.o', 'b.o', 'app', 'app.map', 'build.ninja', 'check', 'gen.h'] == [ e.output for e in latest_entries(runs) ]
+
+  def test_recompacted(self, tmp_path):
+    # A recompacted log lists the outputs in any order, the end times are not sorted ; the next run is not mixed with it
+    p = tmp_path / '.ninja_log'
+    p.write_text('# ninja log v5\n300\t1000\t0\tapp\t3\n0\t100\t0\ta.o\t1\n0\t300\t0\tb.o\t2\n1000\t1100\t0\tcheck\t4\n'
+      '0\t200\t0\tb.o\t2\n200\t800\t0\tapp\t3\n')
+    runs = read_ninja_log(p)
+    assert ['b.o', 'app'] == [ e.output for e in runs[-1] ]
+    res = analyze(runs[-1], GRAPH, jobs=2)
+    assert 800 == res['wall'] and 800 == res['critical_path']['duration']
+
+  def test_unsupported(self, tmp_path):
+    p = tmp_path / '.ninja_log'
+    for header in ('# ninja log v4\n', 'garbage\n', '') :
+      p.write_text(header)
+      with pytest.raises(NinjaLogError) :
+        read_ninja_log(p)
+
+
+class TestAnalyze:
+  def test_analyze(self):
+    res = analyze(entries(), GRAPH, jobs=2, top=3)
+    assert 5 == res['edges']
+    assert 1 == res['unknown']
+    assert 1100 == res['wall']
+    assert 100 + 300 + 700 + 100 + 20 == res['busy']
+    assert res['busy'] / 1100 / 2 == res['utilization']
+    assert 1100 == res['critical_path']['duration']
+    assert ['b.o', 'app', 'check'] == [ e['output'] for e in res['critical_path']['edges'] ]
+    assert [('ld', 1, 700), ('cc', 2, 400), ('test', 1, 100), (None, 1, 20)] == [ (t['name'], t['count'], t['total']) for t in res['rules'] ]
+    assert [('Ld#0', 700), ('Cc#0', 400), (None, 120)] == [ (t['name'], t['total']) for t in res['nodes'] ]
+    assert ['app', 'b.o', 'a.o'] == [ e['output'] for e in res['top'] ]
+    json.dumps(res)
+    text = format_text(res, top=2)
+    assert 'Critical path : 1.100 s\n' in text
+    assert '(1 unknown to the build graph)' in text
+
+  def test_no_timeline(self):
+    res = analyze(entries(), GRAPH, jobs=2, timeline=False)
+    assert 100 + 300 + 700 + 100 + 20 == res['busy']
+    assert None is res['wall'] is res['parallelism'] is res['critical_path']
+    text = format_text(res)
+    assert 'over several runs' in text and 'Critical path' not in text
+
+  def test_empty(self):
+    res = analyze([], GRAPH, jobs=1)
+    assert 0 == res['wall'] and 0 == res['critical_path']['duration']
+    format_text(res)
+
+
+class TestCli:
+  def test_stats(self, tmp_path):
+    (tmp_path / '.ninja_log').write_text(LOG)
+    (tmp_path / Labs.state_dirname).mkdir()
+    (tmp_path / Labs.state_dirname / Labs.graph_filename).write_text(json.dumps(GRAPH))
+    runner = CliRunner()
+    res = runner.invoke(main, ['stats', '-C', str(tmp_path), '--json', '-j', '4'])
+    assert 0 == res.exit_code, res.output
+    assert 1100 == json.loads(res.output)['critical_path']['duration']
+    res = runner.invoke(main, ['stats', '-C', str(tmp_path)])
+    assert 0 == res.exit_code, res.output
+    assert 'Longest edges :' in res.output
+    res = runner.invoke(main, ['stats', '-C', str(tmp_path), '--json', '--all-runs'])
+    assert 0 == res.exit_code, res.output
+    res = json.loads(res.output)
+    assert 6 == res['edges'] and None is res['critical_path']
+
+  def test_stats_missing(self, tmp_path):
+    res = CliRunner().invoke(main, ['stats', '-C', str(tmp_path)])
+    assert 1 == res.exit_code
+    assert 'graph.json' in res.output
+
+  def test_default_command(self, tmp_path):
+    (tmp_path / 'labs_build.py').write_text('')
+    res = CliRunner().invoke(main, [str(tmp_path), '-C', str(tmp_path / 'build')])
+    assert 0 == res.exit_code, res.output
+    assert (tmp_path / 'build' / 'build.ninja').is_file()
+    assert {'version' : 1, 'builds' : []} == json.loads((tmp_path / 'build' / Labs.state_dirname / Labs.graph_filename).read_text())
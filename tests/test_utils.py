@@ -1,5 +1,6 @@
 import pytest
-from labs.utils import dict2Graph, Graph
+import os
+from labs.utils import dict2Graph, Graph, write_if_changed, PathIndex, ConfDict, Dict, pool_depth
 
 
 class TestGraph():
@@ -11,6 +12,28 @@ class TestGraph():
     g = dict2Graph({'A' : ['B'], 'B' : []})
     assert ['A', 'B'] == list(g.topologicalSort())
     
+  def test_toposort_diamond(self):
+    g = dict2Graph({'A' : ['B', 'C'], 'B' : [], 'C' : ['B']})
+    assert ['A', 'C', 'B'] == list(g.topologicalSort())
+
+  def test_toposort_stable(self):
+    g = dict2Graph({'A' : [], 'B' : ['Z'], 'C' : [], 'Z' : []})
+    assert ['A', 'B', 'C', 'Z'] == g.topologicalSort()
+    assert ['A', 'C', 'Z', 'B'] == g.topologicalSort(False)
+
+  def test_toposort_foreign(self):
+    g = Graph(['A', 'B'], lambda n: ['X'] if n == 'A' else [])
+    assert 3 == len(g)
+    assert ['B', 'X', 'A'] == g.topologicalSort(False)
+
+  def test_toposort_cycle_named(self):
+    g = dict2Graph({'A' : ['B'], 'B' : ['C'], 'C' : ['D', 'B'], 'D' : []})
+    for reverse in (True, False) :
+      with pytest.raises(Graph.CycleError) as e :
+        g.topologicalSort(reverse)
+      assert e.value.cycle in (['B', 'C'], ['C', 'B'])
+      assert 'Cycle' in str(e.value)
+
   def test_toposort_cycleError(self):
     g = dict2Graph({'A' : ['A']})
     with pytest.raises(Graph.CycleError) :
@@ -65,3 +88,153 @@ class TestGraph():
     
 
 
+
+class TestWriteIfChanged():
+  def test_write(self, tmp_path):
+    p = tmp_path / 'f'
+    assert write_if_changed(p, ['a', 'b\n', 'c'])
+    assert 'ab\nc' == p.read_text()
+    assert [p] == list(tmp_path.iterdir())
+
+  def test_unchanged(self, tmp_path):
+    p = tmp_path / 'f'
+    p.write_text('abc')
+    os.utime(p, ns=(1000000000, 1000000000))
+    assert not write_if_changed(p, ['a', 'bc'])
+    assert 1000000000 == p.stat().st_mtime_ns
+    assert [p] == list(tmp_path.iterdir())
+
+  def test_changed(self, tmp_path):
+    p = tmp_path / 'f'
+    p.write_text('abc')
+    os.utime(p, ns=(1000000000, 1000000000))
+    assert write_if_changed(p, ['a', 'bd'])
+    assert 'abd' == p.read_text()
+    assert 1000000000 != p.stat().st_mtime_ns
+    assert write_if_changed(p, ['abcd'])
+    assert 'abcd' == p.read_text()
+    assert [p] == list(tmp_path.iterdir())
+
+  def test_error(self, tmp_path):
+    p = tmp_path / 'f'
+    p.write_text('abc')
+    def chunks():
+      yield 'a'
+      raise ValueError()
+    with pytest.raises(ValueError) :
+      write_if_changed(p, chunks())
+    assert 'abc' == p.read_text()
+    assert [p] == list(tmp_path.iterdir())
+
+
+class TestPathIndex():
+  def make_exe(self, p):
+    p.write_text('#!/bin/sh\n')
+    p.chmod(0o755)
+    return p
+
+  def test_which(self, tmp_path, monkeypatch):
+    d1 = tmp_path / 'd1'
+    d2 = tmp_path / 'd2'
+    d1.mkdir()
+    d2.mkdir()
+    self.make_exe(d2 / 'prog')
+    (d1 / 'prog').write_text('not executable')
+    (d1 / 'dir').mkdir()
+    index = PathIndex(os.pathsep.join((str(d1), str(tmp_path / 'missing'), str(d2))))
+    assert str(d2 / 'prog') == index.which('prog')
+    assert None is index.which('dir')
+    assert None is index.which('other')
+    assert str(d2 / 'prog') == index.which(str(d2 / 'prog'))
+    assert None is index.which(str(d1 / 'prog'))
+
+  def test_scan_once(self, tmp_path, monkeypatch):
+    self.make_exe(tmp_path / 'prog')
+    index = PathIndex(str(tmp_path))
+    scandir = os.scandir
+    calls = []
+    monkeypatch.setattr('os.scandir', lambda d: calls.append(d) or scandir(d))
+    for i in range(10) :
+      assert str(tmp_path / 'prog') == index.which('prog')
+      assert None is index.which('other')
+    assert [str(tmp_path)] == calls
+
+  def test_rescan_changed(self, tmp_path):
+    index = PathIndex(str(tmp_path))
+    assert None is index.which('prog')
+    self.make_exe(tmp_path / 'prog')
+    os.utime(tmp_path, ns=(1, 1))
+    assert str(tmp_path / 'prog') == index.which('prog')
+    (tmp_path / 'prog').unlink()
+    os.utime(tmp_path, ns=(2, 2))
+    assert None is index.which('prog')
+
+
+class TestConfDict():
+  def test_layers(self):
+    base = Dict(a=1, n=Dict(x=1))
+    c = ConfDict(base=base)
+    assert 'a' in c and 'n' in c and 'z' not in c
+    assert None is c.get('z')
+    assert {} == c.missing
+    c.n.y = 2
+    c.b = 3
+    assert {'a':1, 'n':{'x':1, 'y':2}, 'b':3} == c
+    assert ['a', 'n', 'b'] == list(c)
+    assert {'a':1, 'n':{'x':1}} == base
+    assert {'a':1, 'n':{'x':1, 'y':2}, 'b':3} == Dict(c).to_dict()
+    assert {'a':1, 'n':{'x':1, 'y':2}, 'b':3} == c.to_dict()
+
+  def test_update(self):
+    src = Dict(n=Dict(x=1))
+    c = ConfDict()
+    c |= src
+    c.n.y = 2
+    assert {'n':{'x':1}} == src
+    c |= {'n':{'z':3}}
+    assert {'n':{'x':1, 'y':2, 'z':3}} == c
+
+  def test_fork(self):
+    c = ConfDict(a=1)
+    c, d = c.fork()
+    c.a = 2
+    d.b = 3
+    assert {'a':2} == c
+    assert {'a':1, 'b':3} == d
+    e, f = d.fork()
+    assert e is not d
+    assert 1 == f.a
+
+  def test_fork_lists(self):
+    c = ConfDict(cflags=['-O2'], n=Dict(l=[1]))
+    c, d = c.fork()
+    c, e = c.fork()
+    d.cflags.append('-g')
+    e.cflags += ['-Wall']
+    d.n.l.append(2)
+    assert ['-O2'] == c.cflags and [1] == c.n.l
+    assert ['-O2', '-g'] == d.cflags and [1, 2] == d.n.l
+    assert ['-O2', '-Wall'] == e.cflags and [1] == e.n.l
+
+  def test_copy(self):
+    c = ConfDict(a=1, l=[1], n=Dict(x=1))
+    d = c.copy()
+    c.a = 2
+    c.l.append(2)
+    c.n.x = 2
+    assert {'a':1, 'l':[1], 'n':{'x':1}} == d
+    d.n.y = 3
+    assert 'y' not in c.n
+
+
+class TestPoolDepth():
+  def test_depth(self, monkeypatch):
+    monkeypatch.setattr('labs.utils.cpu_count', lambda : 8)
+    monkeypatch.setattr('labs.utils.total_memory', lambda : 5 << 30)
+    assert 8 == pool_depth()
+    assert 4 == pool_depth(cpus_per_job=2)
+    assert 2 == pool_depth(memory_per_job=2 << 30)
+    assert 3 == pool_depth(max_depth=3)
+    assert 1 == pool_depth(memory_per_job=8 << 30)
+    monkeypatch.setattr('labs.utils.total_memory', lambda : None)
+    assert 8 == pool_depth(memory_per_job=8 << 30)
@@ -0,0 +1,62 @@
+import os
+import pytest
+from labs.walker import Walker, dirs_unchanged, filter_paths
+
+
+@pytest.fixture
+def tree(tmp_path):
+  for f in ('a.c', 'b.h', 'src/x.c', 'src/y.h', 'src/sub/z.c', 'vendor/v.c', '.git/objects/o.c', 'build/gen.c') :
+    p = tmp_path / f
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text('')
+  return tmp_path
+
+def walk(root, *patterns, **kwargs):
+  w = Walker(root, patterns, **kwargs)
+  return list(w.walk()), list(w.visited)
+
+
+class TestWalker:
+  def test_recursive(self, tree):
+    res, visited = walk(tree, '**/*.c', prune_paths=(tree / 'build',))
+    assert ['a.c', 'src/x.c', 'src/sub/z.c', 'vendor/v.c'] == res
+    assert ['', 'src', 'src/sub', 'vendor'] == visited
+
+  def test_multi_patterns(self, tree):
+    res, visited = walk(tree, '*.h', 'src/*.c', 'src/*.h')
+    assert ['b.h', 'src/x.c', 'src/y.h'] == res
+    assert ['', 'src'] == visited
+
+  def test_exclude(self, tree):
+    res, visited = walk(tree, '**/*.c', exclude=('vendor', 'build/**', '**/z.*'))
+    assert ['a.c', 'src/x.c'] == res
+    assert ['', 'src', 'src/sub'] == visited
+
+  def test_directories(self, tree):
+    res, visited = walk(tree, '**', 'src/s*', prune_names=())
+    assert ['', '.git', 'build', 'src', 'vendor', '.git/objects', 'src/sub'] == res
+    res, visited = walk(tree, 'src/**')
+    assert ['src', 'src/sub'] == res
+
+  def test_syntax(self, tree):
+    assert ['a.c', 'b.h'] == walk(tree, '[ab].?')[0]
+    assert ['b.h', 'build', 'src', 'vendor'] == walk(tree, '[!a]*')[0]
+    for p in ('', '/abs', '../up') :
+      with pytest.raises(ValueError) :
+        Walker(tree, [p])
+
+  def test_threads(self, tree):
+    assert walk(tree, '**/*') == walk(tree, '**/*', threads=4)
+
+  def test_dirs_unchanged(self, tree):
+    w = Walker(tree, ['**/*.c'])
+    list(w.walk())
+    assert dirs_unchanged(tree, w.visited)
+    os.utime(tree / 'src' / 'sub', ns=(1, 1))
+    assert not dirs_unchanged(tree, w.visited)
+
+  def test_filter_paths(self):
+    paths = ['a.c', 'b.h', 'src/x.c', 'src/sub/z.c', 'vendor/v.c']
+    assert ['a.c', 'src/x.c', 'src/sub/z.c'] == list(filter_paths(paths, ['**/*.c'], exclude=['vendor']))
+    assert ['src/x.c'] == list(filter_paths(paths, ['src/*'], exclude=['src/sub/**']))
+    assert [] == list(filter_paths(paths, ['**']))